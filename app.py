@@ -1,12 +1,18 @@
 import streamlit as st
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 from auth.google_auth import GoogleAuth
 from utils.session_manager import SessionManager
-from services.pinecone_service import PineconeService
+from utils.services import get_pinecone_service, fetch_classroom_courses
+
+PROJECT_ZIP = "edututor-ai-project.zip"
 
 # Load environment variables
-load_dotenv()
+@st.cache_resource
+def load_env():
+    """Parse .env once per process instead of on every rerun"""
+    return load_dotenv()
 
 # Configure page
 st.set_page_config(
@@ -16,17 +22,29 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# After set_page_config, which must be the first Streamlit command
+load_env()
+
 # Initialize services
-@st.cache_resource
 def init_services():
     """Initialize all services"""
     try:
-        pinecone_service = PineconeService()
+        pinecone_service = get_pinecone_service()
         return pinecone_service
     except Exception as e:
         st.error(f"Failed to initialize services: {str(e)}")
         return None
 
+@st.cache_resource(show_spinner=False)
+def load_project_zip():
+    """Read the project archive once per process"""
+    return Path(PROJECT_ZIP).read_bytes()
+
+@st.cache_resource
+def get_google_auth():
+    """Share one GoogleAuth instance across reruns"""
+    return GoogleAuth()
+
 def main():
     """Main application entry point"""
     st.title("🎓 EduTutor AI - Personalized Learning Platform")
@@ -61,7 +79,7 @@ def main():
         
         with col2:
             st.subheader("🔍 Google Login")
-            google_auth = GoogleAuth()
+            google_auth = get_google_auth()
             
             if st.button("Login with Google", type="primary"):
                 try:
@@ -104,16 +122,15 @@ def main():
         st.divider()
         st.subheader("📁 Project Download")
         
-        try:
-            with open("edututor-ai-project.zip", "rb") as zip_file:
-                st.download_button(
-                    label="Download Complete EduTutor AI Project",
-                    data=zip_file.read(),
-                    file_name="edututor-ai-project.zip",
-                    mime="application/zip",
-                    help="Download the complete project source code as a zip file"
-                )
-        except FileNotFoundError:
+        if os.path.exists(PROJECT_ZIP):
+            st.download_button(
+                label="Download Complete EduTutor AI Project",
+                data=load_project_zip(),
+                file_name=PROJECT_ZIP,
+                mime="application/zip",
+                help="Download the complete project source code as a zip file"
+            )
+        else:
             st.info("Project zip file not found in current directory.")
         
         # Display available pages based on role
@@ -143,14 +160,22 @@ def main():
         # Google Classroom sync status
         if user_info['login_method'] == 'google':
             st.subheader("🔗 Google Classroom Integration")
-            if st.button("Sync with Google Classroom"):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                sync = st.button("Sync with Google Classroom")
+            
+            with col2:
+                force_resync = st.button("Force resync", help="Ignore courses synced within the last hour")
+            
+            if sync or force_resync:
                 try:
-                    from services.classroom_service import ClassroomService
-                    classroom_service = ClassroomService()
-                    courses = classroom_service.get_courses()
+                    courses, synced_at = fetch_classroom_courses(user_info['user_id'], force=force_resync)
                     if courses:
                         st.success(f"Successfully synced {len(courses)} courses from Google Classroom!")
+                        st.caption(f"Last synced: {synced_at[:16].replace('T', ' ')}")
                         session_manager.update_user_data('synced_courses', courses)
+                        session_manager.update_user_data('last_synced_at', synced_at)
                     else:
                         st.info("No courses found in your Google Classroom.")
                 except Exception as e:
@@ -1,12 +1,35 @@
 import os
 import json
+import threading
+import requests
 import streamlit as st
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import DISCOVERY_URI, build_from_document
+from googleapiclient import discovery_cache
 import secrets
 import string
 
+# Parsed discovery documents, shared by every GoogleAuth instance
+_DISCOVERY_DOCS = {}
+_DISCOVERY_LOCK = threading.Lock()
+
+
+def get_discovery_doc(api, version):
+    """Load a Google API discovery document once per process"""
+    key = (api, version)
+    with _DISCOVERY_LOCK:
+        if key not in _DISCOVERY_DOCS:
+            # Prefer the copy bundled with googleapiclient, fall back to the network
+            doc = discovery_cache.get_static_doc(api, version)
+            if doc is None:
+                response = requests.get(DISCOVERY_URI.format(api=api, apiVersion=version), timeout=10)
+                response.raise_for_status()
+                doc = response.text
+            _DISCOVERY_DOCS[key] = json.loads(doc)
+        return _DISCOVERY_DOCS[key]
+
+
 class GoogleAuth:
     """Handle Google OAuth authentication"""
     
@@ -21,24 +44,23 @@ class GoogleAuth:
             'https://www.googleapis.com/auth/classroom.courses.readonly',
             'https://www.googleapis.com/auth/classroom.rosters.readonly'
         ]
+        # Client configuration is fixed for the lifetime of the instance
+        self.client_config = {
+            "web": {
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": "https://oauth2.googleapis.com/token",
+                "redirect_uris": [self.redirect_uri]
+            }
+        }
     
     def get_authorization_url(self):
         """Generate Google OAuth authorization URL"""
         try:
-            # Create client configuration
-            client_config = {
-                "web": {
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "redirect_uris": [self.redirect_uri]
-                }
-            }
-            
             # Create flow
             flow = Flow.from_client_config(
-                client_config,
+                self.client_config,
                 scopes=self.scopes
             )
             flow.redirect_uri = self.redirect_uri
@@ -90,7 +112,7 @@ class GoogleAuth:
     def get_user_info(self, credentials):
         """Get user information from Google API"""
         try:
-            service = build('oauth2', 'v2', credentials=credentials)
+            service = build_from_document(get_discovery_doc('oauth2', 'v2'), credentials=credentials)
             user_info = service.userinfo().get().execute()
             
             return {
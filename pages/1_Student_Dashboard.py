@@ -1,15 +1,207 @@
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
 import pandas as pd
-from datetime import datetime, timedelta
 from utils.session_manager import SessionManager
-from services.pinecone_service import PineconeService
+from utils.services import load_user_data, load_quiz_aggregates, track_quiz_save
 
 st.set_page_config(page_title="Student Dashboard - EduTutor AI",
                    page_icon="📊",
                    layout="wide")
 
+# Quiz difficulty levels, in the order they are offered on Take Quiz
+DIFFICULTY_LEVELS = ['easy', 'medium', 'hard']
+
+
+# Figure builders are memoized on their input frames, which Streamlit
+# already hashes by content, so unchanged data skips the Plotly rebuild.
+# Entries are bounded and expire with the 5-minute user data cache.
+# Plotly is imported inside them so users without history never load it.
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def build_trend_fig(df_scores):
+    import plotly.express as px
+
+    fig_trend = px.line(df_scores,
+                        x='completed_at',
+                        y='percentage',
+                        title='Quiz Score Trend',
+                        labels={
+                            'percentage': 'Score (%)',
+                            'completed_at': 'Date'
+                        })
+    fig_trend.update_layout(showlegend=False)
+    return fig_trend
+
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def build_topics_fig(topic_scores):
+    import plotly.express as px
+
+    return px.bar(topic_scores,
+                  x='percentage',
+                  y='topic',
+                  orientation='h',
+                  title='Average Score by Topic',
+                  labels={
+                      'percentage': 'Average Score (%)',
+                      'topic': 'Topic'
+                  })
+
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def build_difficulty_figs(difficulty_scores):
+    import plotly.express as px
+
+    fig_diff = px.bar(difficulty_scores,
+                      x='Difficulty',
+                      y='Average Score',
+                      title='Performance by Difficulty Level',
+                      color='Average Score',
+                      color_continuous_scale='RdYlGn')
+    fig_dist = px.pie(difficulty_scores,
+                      values='Quiz Count',
+                      names='Difficulty',
+                      title='Quiz Distribution by Difficulty')
+    return fig_diff, fig_dist
+
+
+@st.fragment
+def render_performance_section(quiz_history, aggregates):
+    """Charts and insights, isolated from widget reruns elsewhere on the page"""
+    # Performance overview
+    st.subheader("📈 Performance Overview")
+
+    # Create performance charts
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # Score trend chart (already ordered by completion time)
+        df_scores = pd.DataFrame(aggregates['trend'])
+        df_scores['completed_at'] = pd.to_datetime(
+            df_scores['completed_at'], format='ISO8601', cache=True)
+
+        st.plotly_chart(build_trend_fig(df_scores),
+                        use_container_width=True)
+
+    with col2:
+        # Topics performance (only the chart needs them sorted)
+        topic_mean = pd.Series({
+            topic: stats['mean']
+            for topic, stats in aggregates['by_topic'].items()
+        }, dtype=float)
+        topic_scores = topic_mean.sort_values().rename_axis(
+            'topic').reset_index(name='percentage')
+
+        st.plotly_chart(build_topics_fig(topic_scores),
+                        use_container_width=True)
+
+    # Recent quizzes
+    st.subheader("🕒 Recent Quiz Results")
+
+    # Display recent quizzes in a table
+    recent = pd.DataFrame(quiz_history[:10])  # Last 10 quizzes
+    df_recent = pd.DataFrame({
+        'Date':
+        recent['completed_at'].str.slice(0, 10),
+        'Topic':
+        recent['topic'].fillna('Unknown'),
+        'Difficulty':
+        # Title-cased before categorizing, so "medium" and "Medium" merge
+        recent['difficulty'].fillna('medium').str.title().astype('category'),
+        'Score':
+        recent['score'].astype(str) + '/' +
+        recent['total_questions'].astype(str),
+        'Percentage':
+        recent['percentage'].map('{:.1f}%'.format),
+        'Time':
+        recent['time_taken'].map('{:.1f}s'.format)
+    })
+    st.dataframe(df_recent, use_container_width=True, hide_index=True)
+
+    # Learning insights
+    st.subheader("🎯 Learning Insights")
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        # Strongest topics
+        if len(topic_mean) > 0:
+            best_topic = topic_mean.idxmax()
+            st.success(f"**Strongest Topic**: {best_topic}")
+            st.write(f"Average Score: {topic_mean[best_topic]:.1f}%")
+
+    with col2:
+        # Topics needing improvement
+        if len(topic_mean) > 0:
+            weak_topic = topic_mean.idxmin()
+            st.warning(f"**Needs Improvement**: {weak_topic}")
+            st.write(f"Average Score: {topic_mean[weak_topic]:.1f}%")
+
+    with col3:
+        # Study streak
+        if len(quiz_history) > 1:
+            recent_week = df_scores.nlargest(
+                7, 'completed_at')['completed_at'].dt.date
+            unique_dates = recent_week.nunique()
+            st.info(
+                f"**Recent Activity**: {unique_dates} days in last week")
+
+    # Difficulty analysis
+    st.subheader("⚖️ Difficulty Analysis")
+
+    difficulty_scores = pd.DataFrame(
+        [(difficulty, stats['mean'], stats['count'])
+         for difficulty, stats in aggregates['by_difficulty'].items()],
+        columns=['Difficulty', 'Average Score', 'Quiz Count'])
+    # Stored difficulties vary in case and may be missing, so normalize the
+    # keys and merge duplicates with a count-weighted mean
+    difficulty_scores['Difficulty'] = difficulty_scores['Difficulty'].str.lower(
+    ).fillna('medium').replace('', 'medium')
+    difficulty_scores['Total'] = difficulty_scores[
+        'Average Score'] * difficulty_scores['Quiz Count']
+    difficulty_scores = difficulty_scores.groupby(
+        'Difficulty', as_index=False)[['Total', 'Quiz Count']].sum()
+    difficulty_scores['Average Score'] = difficulty_scores.pop(
+        'Total') / difficulty_scores['Quiz Count']
+    # Title-case once per category rather than per row, keeping easy→hard
+    # order with any unknown levels after the known ones
+    levels = DIFFICULTY_LEVELS + sorted(
+        set(difficulty_scores['Difficulty']) - set(DIFFICULTY_LEVELS))
+    difficulty_scores['Difficulty'] = pd.Categorical(
+        difficulty_scores['Difficulty'], categories=levels, ordered=True)
+    difficulty_scores = difficulty_scores.sort_values('Difficulty')
+    difficulty_scores['Difficulty'] = difficulty_scores[
+        'Difficulty'].cat.rename_categories(str.title)
+
+    fig_diff, fig_dist = build_difficulty_figs(difficulty_scores)
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # Difficulty performance
+        st.plotly_chart(fig_diff, use_container_width=True)
+
+    with col2:
+        # Quiz distribution
+        st.plotly_chart(fig_dist, use_container_width=True)
+
+
+@st.fragment
+def render_quick_actions():
+    """Navigation buttons that rerun only this fragment when clicked"""
+    st.subheader("🚀 Quick Actions")
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        if st.button("📝 Take New Quiz", use_container_width=True):
+            st.switch_page("pages/2_Take_Quiz.py")
+
+    with col2:
+        if st.button("📚 View Quiz History", use_container_width=True):
+            st.switch_page("pages/3_Quiz_History.py")
+
+    with col3:
+        if st.button("⚙️ Update Profile", use_container_width=True):
+            st.info("Profile update functionality coming soon!")
+
 
 def main():
     """Student Dashboard main function"""
@@ -17,7 +209,6 @@ def main():
 
     # Initialize services
     session_manager = SessionManager()
-    pinecone_service = PineconeService()
 
     # Check authentication
     if not session_manager.is_authenticated():
@@ -31,12 +222,12 @@ def main():
         st.error("This dashboard is only available for students.")
         st.stop()
 
-    # Get user profile
-    user_profile = pinecone_service.get_user_profile(user_info['user_id'])
-    if not user_profile:
-        # Create new profile if doesn't exist
-        pinecone_service.create_user_profile(user_info['user_id'], user_info)
-        user_profile = pinecone_service.get_user_profile(user_info['user_id'])
+    # A quiz may still be saving if the student came straight from its results
+    track_quiz_save()
+
+    # Get user profile (created on first visit) and quiz history in one go
+    user_profile, quiz_history = load_user_data(user_info['user_id'],
+                                                user_info)
 
     # Dashboard header
     col1, col2, col3 = st.columns([2, 1, 1])
@@ -56,139 +247,9 @@ def main():
 
     st.divider()
 
-    # Get quiz history
-    quiz_history = pinecone_service.get_quiz_history(user_info['user_id'])
-
     if quiz_history:
-        # Performance overview
-        st.subheader("📈 Performance Overview")
-
-        # Create performance charts
-        col1, col2 = st.columns(2)
-
-        with col1:
-            # Score trend chart
-            df_scores = pd.DataFrame(quiz_history)
-            df_scores['completed_at'] = pd.to_datetime(
-                df_scores['completed_at'])
-            df_scores = df_scores.sort_values('completed_at')
-
-            fig_trend = px.line(df_scores,
-                                x='completed_at',
-                                y='percentage',
-                                title='Quiz Score Trend',
-                                labels={
-                                    'percentage': 'Score (%)',
-                                    'completed_at': 'Date'
-                                })
-            fig_trend.update_layout(showlegend=False)
-            st.plotly_chart(fig_trend, use_container_width=True)
-
-        with col2:
-            # Topics performance
-            topic_scores = df_scores.groupby(
-                'topic')['percentage'].mean().reset_index()
-            topic_scores = topic_scores.sort_values('percentage',
-                                                    ascending=True)
-
-            fig_topics = px.bar(topic_scores,
-                                x='percentage',
-                                y='topic',
-                                orientation='h',
-                                title='Average Score by Topic',
-                                labels={
-                                    'percentage': 'Average Score (%)',
-                                    'topic': 'Topic'
-                                })
-            st.plotly_chart(fig_topics, use_container_width=True)
-
-        # Recent quizzes
-        st.subheader("🕒 Recent Quiz Results")
-
-        # Display recent quizzes in a table
-        recent_quizzes = quiz_history[:10]  # Last 10 quizzes
-        quiz_data = []
-
-        for quiz in recent_quizzes:
-            quiz_data.append({
-                'Date':
-                quiz.get('completed_at', '')[:10],
-                'Topic':
-                quiz.get('topic', 'Unknown'),
-                'Difficulty':
-                quiz.get('difficulty', 'Medium').title(),
-                'Score':
-                f"{quiz.get('score', 0)}/{quiz.get('total_questions', 0)}",
-                'Percentage':
-                f"{quiz.get('percentage', 0):.1f}%",
-                'Time':
-                f"{quiz.get('time_taken', 0):.1f}s"
-            })
-
-        if quiz_data:
-            df_recent = pd.DataFrame(quiz_data)
-            st.dataframe(df_recent, use_container_width=True, hide_index=True)
-
-        # Learning insights
-        st.subheader("🎯 Learning Insights")
-
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            # Strongest topics
-            if len(topic_scores) > 0:
-                best_topic = topic_scores.iloc[-1]
-                st.success(f"**Strongest Topic**: {best_topic['topic']}")
-                st.write(f"Average Score: {best_topic['percentage']:.1f}%")
-
-        with col2:
-            # Topics needing improvement
-            if len(topic_scores) > 0:
-                weak_topic = topic_scores.iloc[0]
-                st.warning(f"**Needs Improvement**: {weak_topic['topic']}")
-                st.write(f"Average Score: {weak_topic['percentage']:.1f}%")
-
-        with col3:
-            # Study streak
-            if len(quiz_history) > 1:
-                recent_dates = [
-                    datetime.fromisoformat(q['completed_at']).date()
-                    for q in quiz_history[:7]
-                ]
-                unique_dates = len(set(recent_dates))
-                st.info(
-                    f"**Recent Activity**: {unique_dates} days in last week")
-
-        # Difficulty analysis
-        st.subheader("⚖️ Difficulty Analysis")
-
-        difficulty_scores = df_scores.groupby('difficulty')['percentage'].agg(
-            ['mean', 'count']).reset_index()
-        difficulty_scores.columns = [
-            'Difficulty', 'Average Score', 'Quiz Count'
-        ]
-        difficulty_scores['Difficulty'] = difficulty_scores[
-            'Difficulty'].str.title()
-
-        col1, col2 = st.columns(2)
-
-        with col1:
-            # Difficulty performance
-            fig_diff = px.bar(difficulty_scores,
-                              x='Difficulty',
-                              y='Average Score',
-                              title='Performance by Difficulty Level',
-                              color='Average Score',
-                              color_continuous_scale='RdYlGn')
-            st.plotly_chart(fig_diff, use_container_width=True)
-
-        with col2:
-            # Quiz distribution
-            fig_dist = px.pie(difficulty_scores,
-                              values='Quiz Count',
-                              names='Difficulty',
-                              title='Quiz Distribution by Difficulty')
-            st.plotly_chart(fig_dist, use_container_width=True)
+        aggregates = load_quiz_aggregates(user_info['user_id'], quiz_history)
+        render_performance_section(quiz_history, aggregates)
 
     else:
         # No quiz history
@@ -232,21 +293,7 @@ def main():
 
     # Quick actions
     st.divider()
-    st.subheader("🚀 Quick Actions")
-
-    col1, col2, col3 = st.columns(3)
-
-    with col1:
-        if st.button("📝 Take New Quiz", use_container_width=True):
-            st.switch_page("pages/2_Take_Quiz.py")
-
-    with col2:
-        if st.button("📚 View Quiz History", use_container_width=True):
-            st.switch_page("pages/3_Quiz_History.py")
-
-    with col3:
-        if st.button("⚙️ Update Profile", use_container_width=True):
-            st.info("Profile update functionality coming soon!")
+    render_quick_actions()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,11 @@
 import streamlit as st
 import time
+import copy
 from datetime import datetime
+from bisect import bisect_right
 from utils.session_manager import SessionManager
-from services.huggingface_service import HuggingFaceService
-from services.pinecone_service import PineconeService
-from utils.quiz_parser import QuizParser
+from utils.services import get_hf_service, get_quiz_parser, get_background_executor, submit_quiz_result, track_quiz_save
+from utils.quiz_review import build_question_review
 
 st.set_page_config(
     page_title="Take Quiz - EduTutor AI",
@@ -12,15 +13,258 @@ st.set_page_config(
     layout="wide"
 )
 
+# Quiz state and its starting values; copied on use so sessions never share the mutable ones
+QUIZ_DEFAULTS = {
+    'quiz_started': False,
+    'quiz_questions': [],
+    'current_question': 0,
+    'user_answers': {},
+    'quiz_start_time': None,
+    'quiz_completed': False,
+    'quiz_results': None,
+    'show_submit_dialog': False,
+    'next_quiz': None
+}
+
+# Lowest percentage earning each letter grade / feedback message, ascending
+GRADE_CUTOFFS = (0, 60, 70, 80, 90)
+GRADE_LETTERS = ("F", "C", "B", "A", "A+")
+FEEDBACK_CUTOFFS = (0, 60, 80)
+FEEDBACK_MESSAGES = (
+    (st.warning, "📚 Keep studying! Consider reviewing the material and trying again."),
+    (st.info, "👍 Good job! You have a solid grasp of the material with room for improvement."),
+    (st.success, "🎯 Excellent work! You have a strong understanding of this topic.")
+)
+
+# Cutoffs are whole percents, so both are looked up in tables built once per whole percent
+GRADE_TABLE = tuple(GRADE_LETTERS[bisect_right(GRADE_CUTOFFS, p) - 1] for p in range(101))
+FEEDBACK_TABLE = tuple(FEEDBACK_MESSAGES[bisect_right(FEEDBACK_CUTOFFS, p) - 1] for p in range(101))
+
+def performance_grade(percentage):
+    """Letter grade for a score"""
+    return GRADE_TABLE[min(100, max(0, int(percentage)))]
+
+def performance_feedback(percentage):
+    """(st message function, text) for a score"""
+    return FEEDBACK_TABLE[min(100, max(0, int(percentage)))]
+
+def normalize_topic(topic):
+    """Lowercase and collapse whitespace so trivially different topics match"""
+    return " ".join(topic.split()).lower()
+
+def start_quiz(questions, topic, difficulty, time_limit):
+    """Put a freshly generated quiz into session state; time_limit is in seconds"""
+    # Drop radio selections left over from the previous quiz
+    for key in [key for key in st.session_state if str(key).startswith('question_')]:
+        del st.session_state[key]
+    st.session_state.quiz_questions = questions
+    st.session_state.quiz_topic = topic
+    st.session_state.quiz_difficulty = difficulty
+    st.session_state.quiz_time_limit = time_limit
+    st.session_state.user_answers = {}
+    st.session_state.current_question = 0
+    st.session_state.quiz_started = True
+    st.session_state.quiz_start_time = time.time()
+    st.session_state.quiz_completed = False
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def generate_quiz(topic, difficulty, num_questions):
+    """Generate quiz questions, reusing the result for identical setups within the hour"""
+    # Raises on failure, so generic fallback questions are never cached
+    return get_hf_service().generate_quiz_questions(
+        topic=topic,
+        difficulty=difficulty,
+        num_questions=num_questions,
+        fallback=False
+    )
+
+@st.fragment(run_every="1s")
+def render_quiz_panel():
+    """Question panel and countdown; reruns on its own every second and on navigation"""
+    questions = st.session_state.quiz_questions
+    current_q = st.session_state.current_question
+    
+    # Calculate time remaining
+    elapsed_time = time.time() - st.session_state.quiz_start_time
+    time_remaining = st.session_state.quiz_time_limit - elapsed_time
+    
+    # Time's up check
+    if time_remaining <= 0:
+        st.warning("⏰ Time's up! Submitting your quiz...")
+        st.session_state.quiz_completed = True
+        st.rerun()  # Whole page, to move on to the results phase
+    
+    # Quiz header with progress
+    col1, col2, col3 = st.columns([2, 1, 1])
+    
+    with col1:
+        st.subheader(f"📚 {st.session_state.quiz_topic}")
+        progress = (current_q + 1) / len(questions)
+        st.progress(progress, f"Question {current_q + 1} of {len(questions)}")
+    
+    with col2:
+        st.metric("Difficulty", st.session_state.quiz_difficulty.title())
+    
+    with col3:
+        minutes_remaining = int(time_remaining // 60)
+        seconds_remaining = int(time_remaining % 60)
+        st.metric("Time Left", f"{minutes_remaining:02d}:{seconds_remaining:02d}")
+    
+    st.divider()
+    
+    # Display current question
+    if current_q < len(questions):
+        question = questions[current_q]
+        
+        st.subheader(f"Question {current_q + 1}")
+        st.write(question['question'])
+        
+        # Display options
+        options = question.get('options', {})
+        if options:
+            # Get previously selected answer
+            prev_answer = st.session_state.user_answers.get(current_q)
+            
+            # Radio returns the answer key (A, B, C, D) directly
+            option_keys = list(options.keys())
+            answer_key = st.radio(
+                "Select your answer:",
+                option_keys,
+                index=option_keys.index(prev_answer) if prev_answer in option_keys else None,
+                format_func=lambda key: f"{key}) {options[key]}",
+                key=f"question_{current_q}"
+            )
+            
+            if answer_key is not None:
+                st.session_state.user_answers[current_q] = answer_key
+        
+        # Navigation buttons
+        col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+        
+        with col1:
+            if current_q > 0:
+                if st.button("⬅️ Previous", use_container_width=True):
+                    st.session_state.current_question = current_q - 1
+                    st.rerun(scope="fragment")
+        
+        with col2:
+            if current_q < len(questions) - 1:
+                if st.button("Next ➡️", use_container_width=True):
+                    st.session_state.current_question = current_q + 1
+                    st.rerun(scope="fragment")
+        
+        with col3:
+            # Show progress summary
+            answered = len(st.session_state.user_answers)
+            if st.button(f"Progress ({answered}/{len(questions)})", use_container_width=True):
+                st.info(f"You have answered {answered} out of {len(questions)} questions.")
+        
+        with col4:
+            if st.button("Submit Quiz", type="primary", use_container_width=True):
+                # Confirmation dialog is opened from main(), outside the ticking fragment
+                st.session_state.show_submit_dialog = True
+                st.rerun()
+
+@st.dialog("Submit Quiz?")
+def confirm_submit():
+    """Confirm submission, warning about unanswered questions"""
+    questions = st.session_state.quiz_questions
+    answered = len(st.session_state.user_answers)
+    if answered < len(questions):
+        st.warning(f"You have only answered {answered} out of {len(questions)} questions. Unanswered questions will be marked as incorrect.")
+    else:
+        st.write("You have answered every question.")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        if st.button("Confirm Submit", type="primary", use_container_width=True):
+            st.session_state.quiz_completed = True
+            st.rerun()
+    
+    with col2:
+        if st.button("Keep Going", use_container_width=True):
+            st.rerun()
+
+@st.fragment
+def render_results():
+    """Results summary and review; toggling the breakdown only reruns this section"""
+    results = st.session_state.quiz_results
+    
+    st.title("🎉 Quiz Completed!")
+    
+    # Results summary
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("Score", f"{results['score']}/{results['total_questions']}")
+    
+    with col2:
+        percentage = results['percentage']
+        st.metric("Percentage", f"{percentage:.1f}%")
+    
+    with col3:
+        st.metric("Time Taken", f"{results['time_taken']:.1f}s")
+    
+    with col4:
+        st.metric("Grade", performance_grade(percentage))
+    
+    # Performance feedback
+    st.divider()
+    st.subheader("📊 Performance Analysis")
+    
+    show_feedback, feedback = performance_feedback(percentage)
+    show_feedback(feedback)
+    
+    # Detailed results
+    if st.checkbox("Show detailed results"):
+        st.subheader("📝 Question-by-Question Review")
+        
+        for i, review in enumerate(results['per_question']):
+            with st.expander(f"Question {i+1} - {'✅ Correct' if review['is_correct'] else '❌ Incorrect'}"):
+                st.write(f"**Question:** {review['question']}")
+                
+                for line in review['option_lines']:
+                    st.write(line)
+                
+                st.write(f"**Your answer:** {review['user_answer']}")
+                st.write(f"**Correct answer:** {review['correct_answer']}")
+                
+                if review['explanation']:
+                    st.write(f"**Explanation:** {review['explanation']}")
+    
+    # Action buttons
+    st.divider()
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if st.button("Take Another Quiz", type="primary", use_container_width=True):
+            next_quiz = st.session_state.next_quiz
+            
+            # Reset quiz state
+            st.session_state.update(copy.deepcopy(QUIZ_DEFAULTS))
+            
+            # Go straight into the prefetched quiz if it is ready, otherwise back to setup
+            future = next_quiz['future'] if next_quiz else None
+            if future and future.done() and future.exception() is None and future.result():
+                start_quiz(future.result(), next_quiz['topic'], next_quiz['difficulty'], next_quiz['time_limit'])
+            st.rerun()
+    
+    with col2:
+        if st.button("View Quiz History", use_container_width=True):
+            st.switch_page("pages/3_Quiz_History.py")
+    
+    with col3:
+        if st.button("Back to Dashboard", use_container_width=True):
+            st.switch_page("pages/1_Student_Dashboard.py")
+
 def main():
     """Take Quiz main function"""
     st.title("📝 Take Quiz")
     
     # Initialize services
     session_manager = SessionManager()
-    hf_service = HuggingFaceService()
-    pinecone_service = PineconeService()
-    quiz_parser = QuizParser()
+    quiz_parser = get_quiz_parser()
     
     # Check authentication
     if not session_manager.is_authenticated():
@@ -35,20 +279,9 @@ def main():
         st.stop()
     
     # Initialize session state for quiz
-    if 'quiz_started' not in st.session_state:
-        st.session_state.quiz_started = False
-    if 'quiz_questions' not in st.session_state:
-        st.session_state.quiz_questions = []
-    if 'current_question' not in st.session_state:
-        st.session_state.current_question = 0
-    if 'user_answers' not in st.session_state:
-        st.session_state.user_answers = {}
-    if 'quiz_start_time' not in st.session_state:
-        st.session_state.quiz_start_time = None
-    if 'quiz_completed' not in st.session_state:
-        st.session_state.quiz_completed = False
-    if 'quiz_results' not in st.session_state:
-        st.session_state.quiz_results = None
+    for key, value in QUIZ_DEFAULTS.items():
+        if key not in st.session_state:
+            st.session_state[key] = copy.copy(value)
     
     # Quiz setup phase
     if not st.session_state.quiz_started:
@@ -95,23 +328,19 @@ def main():
                     st.error("Please enter a quiz topic.")
                 else:
                     with st.spinner("Generating your personalized quiz..."):
-                        # Generate quiz questions
-                        questions = hf_service.generate_quiz_questions(
-                            topic=topic.strip(),
-                            difficulty=difficulty,
-                            num_questions=num_questions
-                        )
+                        # Generate quiz questions (topic normalized so trivial variations share a cache entry)
+                        try:
+                            questions = generate_quiz(
+                                normalize_topic(topic),
+                                difficulty,
+                                num_questions
+                            )
+                        except Exception as e:
+                            st.warning(f"Failed to generate quiz questions: {str(e)}")
+                            questions = get_hf_service().generate_fallback_quiz(topic.strip(), num_questions)
                         
                         if questions:
-                            st.session_state.quiz_questions = questions
-                            st.session_state.quiz_topic = topic.strip()
-                            st.session_state.quiz_difficulty = difficulty
-                            st.session_state.quiz_time_limit = time_limit * 60  # Convert to seconds
-                            st.session_state.user_answers = {}
-                            st.session_state.current_question = 0
-                            st.session_state.quiz_started = True
-                            st.session_state.quiz_start_time = time.time()
-                            st.session_state.quiz_completed = False
+                            start_quiz(questions, topic.strip(), difficulty, time_limit * 60)  # Convert to seconds
                             st.success(f"Generated {len(questions)} questions on {topic}!")
                             st.rerun()
                         else:
@@ -119,95 +348,11 @@ def main():
     
     # Quiz taking phase
     elif st.session_state.quiz_started and not st.session_state.quiz_completed:
-        questions = st.session_state.quiz_questions
-        current_q = st.session_state.current_question
-        
-        # Calculate time remaining
-        elapsed_time = time.time() - st.session_state.quiz_start_time
-        time_remaining = st.session_state.quiz_time_limit - elapsed_time
-        
-        # Time's up check
-        if time_remaining <= 0:
-            st.warning("⏰ Time's up! Submitting your quiz...")
-            st.session_state.quiz_completed = True
-            st.rerun()
-        
-        # Quiz header with progress
-        col1, col2, col3 = st.columns([2, 1, 1])
-        
-        with col1:
-            st.subheader(f"📚 {st.session_state.quiz_topic}")
-            progress = (current_q + 1) / len(questions)
-            st.progress(progress, f"Question {current_q + 1} of {len(questions)}")
-        
-        with col2:
-            st.metric("Difficulty", st.session_state.quiz_difficulty.title())
-        
-        with col3:
-            minutes_remaining = int(time_remaining // 60)
-            seconds_remaining = int(time_remaining % 60)
-            st.metric("Time Left", f"{minutes_remaining:02d}:{seconds_remaining:02d}")
-        
-        st.divider()
-        
-        # Display current question
-        if current_q < len(questions):
-            question = questions[current_q]
-            
-            st.subheader(f"Question {current_q + 1}")
-            st.write(question['question'])
-            
-            # Display options
-            options = question.get('options', {})
-            if options:
-                # Get previously selected answer
-                prev_answer = st.session_state.user_answers.get(current_q)
-                
-                # Create radio button for options
-                option_list = [f"{key}) {value}" for key, value in options.items()]
-                selected_option = st.radio(
-                    "Select your answer:",
-                    option_list,
-                    index=None if prev_answer is None else list(options.keys()).index(prev_answer),
-                    key=f"question_{current_q}"
-                )
-                
-                if selected_option:
-                    # Extract the answer key (A, B, C, D)
-                    answer_key = selected_option.split(')')[0]
-                    st.session_state.user_answers[current_q] = answer_key
-            
-            # Navigation buttons
-            col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
-            
-            with col1:
-                if current_q > 0:
-                    if st.button("⬅️ Previous", use_container_width=True):
-                        st.session_state.current_question = current_q - 1
-                        st.rerun()
-            
-            with col2:
-                if current_q < len(questions) - 1:
-                    if st.button("Next ➡️", use_container_width=True):
-                        st.session_state.current_question = current_q + 1
-                        st.rerun()
-            
-            with col3:
-                # Show progress summary
-                answered = len(st.session_state.user_answers)
-                if st.button(f"Progress ({answered}/{len(questions)})", use_container_width=True):
-                    st.info(f"You have answered {answered} out of {len(questions)} questions.")
-            
-            with col4:
-                if st.button("Submit Quiz", type="primary", use_container_width=True):
-                    # Confirm submission
-                    answered = len(st.session_state.user_answers)
-                    if answered < len(questions):
-                        st.warning(f"You have only answered {answered} out of {len(questions)} questions. Unanswered questions will be marked as incorrect.")
-                    
-                    if st.button("Confirm Submit", type="secondary"):
-                        st.session_state.quiz_completed = True
-                        st.rerun()
+        render_quiz_panel()
+        if st.session_state.show_submit_dialog:
+            # Cleared as soon as it opens, so a dialog dismissed with X or Esc stays closed
+            st.session_state.show_submit_dialog = False
+            confirm_submit()
     
     # Quiz results phase
     elif st.session_state.quiz_completed:
@@ -219,6 +364,11 @@ def main():
                     st.session_state.user_answers,
                     st.session_state.quiz_start_time
                 )
+                # Work out the per-question review once rather than on every toggle
+                results['per_question'] = build_question_review(
+                    st.session_state.quiz_questions,
+                    st.session_state.user_answers
+                )
                 
                 # Store results in database
                 quiz_data = {
@@ -232,110 +382,41 @@ def main():
                     'time_taken': results['time_taken']
                 }
                 
-                success = pinecone_service.store_quiz_result(user_info['user_id'], quiz_data)
-                if success:
-                    st.session_state.quiz_results = results
-                else:
-                    st.error("Failed to save quiz results.")
+                # Saved in the background so results show without waiting on Pinecone;
+                # every page reports the outcome via track_quiz_save
+                st.session_state.quiz_save = {
+                    'user_id': user_info['user_id'],
+                    'quiz_data': quiz_data,
+                    'future': submit_quiz_result(user_info['user_id'], quiz_data),
+                    'retried': False,
+                    'saved': False,
+                    'failed': False
+                }
+                st.balloons()
+                st.session_state.quiz_results = results
+                
+                # Generate a follow-up quiz on the same setup while the student reads their results.
+                # This bypasses generate_quiz's cache, which would hand back the same questions.
+                st.session_state.next_quiz = {
+                    'future': get_background_executor().submit(
+                        get_hf_service().generate_quiz_questions,
+                        normalize_topic(st.session_state.quiz_topic),
+                        st.session_state.quiz_difficulty,
+                        len(st.session_state.quiz_questions),
+                        fallback=False
+                    ),
+                    'topic': st.session_state.quiz_topic,
+                    'difficulty': st.session_state.quiz_difficulty,
+                    'time_limit': st.session_state.quiz_time_limit
+                }
         
         # Display results
         if st.session_state.quiz_results:
-            results = st.session_state.quiz_results
-            
-            st.balloons()
-            st.title("🎉 Quiz Completed!")
-            
-            # Results summary
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                st.metric("Score", f"{results['score']}/{results['total_questions']}")
-            
-            with col2:
-                percentage = results['percentage']
-                color = "normal"
-                if percentage >= 80:
-                    color = "normal"
-                elif percentage >= 60:
-                    color = "normal"
-                else:
-                    color = "inverse"
-                st.metric("Percentage", f"{percentage:.1f}%")
-            
-            with col3:
-                st.metric("Time Taken", f"{results['time_taken']:.1f}s")
-            
-            with col4:
-                if percentage >= 90:
-                    grade = "A+"
-                elif percentage >= 80:
-                    grade = "A"
-                elif percentage >= 70:
-                    grade = "B"
-                elif percentage >= 60:
-                    grade = "C"
-                else:
-                    grade = "F"
-                st.metric("Grade", grade)
-            
-            # Performance feedback
-            st.divider()
-            st.subheader("📊 Performance Analysis")
-            
-            if percentage >= 80:
-                st.success("🎯 Excellent work! You have a strong understanding of this topic.")
-            elif percentage >= 60:
-                st.info("👍 Good job! You have a solid grasp of the material with room for improvement.")
-            else:
-                st.warning("📚 Keep studying! Consider reviewing the material and trying again.")
-            
-            # Detailed results
-            if st.checkbox("Show detailed results"):
-                st.subheader("📝 Question-by-Question Review")
-                
-                for i, question in enumerate(st.session_state.quiz_questions):
-                    user_answer = st.session_state.user_answers.get(i, "Not answered")
-                    correct_answer = question.get('correct_answer', 'Unknown')
-                    is_correct = user_answer == correct_answer
-                    
-                    with st.expander(f"Question {i+1} - {'✅ Correct' if is_correct else '❌ Incorrect'}"):
-                        st.write(f"**Question:** {question['question']}")
-                        
-                        options = question.get('options', {})
-                        for key, value in options.items():
-                            icon = ""
-                            if key == correct_answer:
-                                icon = "✅"
-                            elif key == user_answer and not is_correct:
-                                icon = "❌"
-                            st.write(f"{icon} {key}) {value}")
-                        
-                        st.write(f"**Your answer:** {user_answer}")
-                        st.write(f"**Correct answer:** {correct_answer}")
-                        
-                        if question.get('explanation'):
-                            st.write(f"**Explanation:** {question['explanation']}")
-            
-            # Action buttons
-            st.divider()
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                if st.button("Take Another Quiz", type="primary", use_container_width=True):
-                    # Reset quiz state
-                    for key in ['quiz_started', 'quiz_questions', 'current_question', 
-                               'user_answers', 'quiz_start_time', 'quiz_completed', 'quiz_results']:
-                        if key in st.session_state:
-                            del st.session_state[key]
-                    st.rerun()
-            
-            with col2:
-                if st.button("View Quiz History", use_container_width=True):
-                    st.switch_page("pages/3_Quiz_History.py")
-            
-            with col3:
-                if st.button("Back to Dashboard", use_container_width=True):
-                    st.switch_page("pages/1_Student_Dashboard.py")
+            render_results()
+    
+    # After every phase, so a save started above is polled this run; it is kept
+    # out of QUIZ_DEFAULTS, so starting another quiz still reports the last save
+    track_quiz_save()
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,11 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from plotly.subplots import make_subplots
+from datetime import datetime
 from utils.session_manager import SessionManager
-from services.pinecone_service import PineconeService
+from utils.services import load_quiz_history, track_quiz_save
+from utils.quiz_review import build_question_review
 
 st.set_page_config(
     page_title="Quiz History - EduTutor AI",
@@ -12,13 +13,24 @@ st.set_page_config(
     layout="wide"
 )
 
+# Date range options and their window in days; the window is applied when loading
+DATE_RANGES = {"All Time": None, "Last 7 Days": 7, "Last 30 Days": 30, "Last 90 Days": 90}
+
+def date_range_select():
+    """Date range filter; keyed so its value is known before the history loads"""
+    return st.selectbox(
+        "Date Range",
+        list(DATE_RANGES),
+        key="history_date_range",
+        help="Filter by date range"
+    )
+
 def main():
     """Quiz History main function"""
     st.title("📚 Quiz History")
     
     # Initialize services
     session_manager = SessionManager()
-    pinecone_service = PineconeService()
     
     # Check authentication
     if not session_manager.is_authenticated():
@@ -32,8 +44,19 @@ def main():
         st.error("Quiz history is only available for students.")
         st.stop()
     
-    # Get quiz history
-    quiz_history = pinecone_service.get_quiz_history(user_info['user_id'])
+    # A quiz may still be saving if the student came straight from its results
+    track_quiz_save()
+    
+    # Get quiz history (cached, so filter changes don't re-query Pinecone).
+    # Only the date window is pushed down; topic/difficulty also drive the
+    # filter options, and the score slider is cheaper to apply locally.
+    date_range = st.session_state.get("history_date_range", "All Time")
+    quiz_history = load_quiz_history(user_info['user_id'], limit=200, days=DATE_RANGES[date_range])
+    
+    if not quiz_history and DATE_RANGES[date_range]:
+        st.warning("No quizzes in this date range. Try a longer range.")
+        date_range_select()
+        return
     
     if not quiz_history:
         st.info("No quiz history found. Take your first quiz to see your results here!")
@@ -44,6 +67,17 @@ def main():
                 st.switch_page("pages/2_Take_Quiz.py")
         return
     
+    # Build the frame once; filters below are vectorized masks over it
+    df_all = pd.DataFrame(quiz_history).fillna({
+        'topic': 'Unknown', 'difficulty': 'medium', 'percentage': 0, 'time_taken': 0
+    })
+    df_all['completed_dt'] = pd.to_datetime(df_all['completed_at'], format='ISO8601', errors='coerce')
+    df_all['date_str'] = df_all['completed_dt'].dt.strftime('%Y-%m-%d')
+    df_all['time_str'] = df_all['completed_dt'].dt.strftime('%H:%M')
+    
+    all_topics = sorted(df_all['topic'].unique().tolist())
+    all_difficulties = sorted(df_all['difficulty'].unique().tolist())
+    
     # Filter controls
     st.subheader("🔍 Filter Results")
     
@@ -51,7 +85,6 @@ def main():
     
     with col1:
         # Topic filter
-        all_topics = sorted(list(set([quiz.get('topic', 'Unknown') for quiz in quiz_history])))
         selected_topics = st.multiselect(
             "Topics",
             all_topics,
@@ -61,7 +94,6 @@ def main():
     
     with col2:
         # Difficulty filter
-        all_difficulties = sorted(list(set([quiz.get('difficulty', 'medium') for quiz in quiz_history])))
         selected_difficulties = st.multiselect(
             "Difficulty",
             all_difficulties,
@@ -71,11 +103,7 @@ def main():
     
     with col3:
         # Date range filter
-        date_range = st.selectbox(
-            "Date Range",
-            ["All Time", "Last 7 Days", "Last 30 Days", "Last 90 Days"],
-            help="Filter by date range"
-        )
+        date_range_select()
     
     with col4:
         # Score filter
@@ -85,46 +113,32 @@ def main():
             help="Filter by minimum score percentage"
         )
     
-    # Apply filters
-    filtered_history = quiz_history.copy()
+    # Apply filters (score filter always applies)
+    mask = df_all['percentage'] >= min_score
     
     # Topic filter
     if selected_topics:
-        filtered_history = [q for q in filtered_history if q.get('topic') in selected_topics]
+        mask &= df_all['topic'].isin(selected_topics)
     
     # Difficulty filter
     if selected_difficulties:
-        filtered_history = [q for q in filtered_history if q.get('difficulty') in selected_difficulties]
-    
-    # Date range filter
-    if date_range != "All Time":
-        cutoff_date = datetime.now()
-        if date_range == "Last 7 Days":
-            cutoff_date -= timedelta(days=7)
-        elif date_range == "Last 30 Days":
-            cutoff_date -= timedelta(days=30)
-        elif date_range == "Last 90 Days":
-            cutoff_date -= timedelta(days=90)
-        
-        filtered_history = [q for q in filtered_history 
-                           if datetime.fromisoformat(q.get('completed_at', '')) >= cutoff_date]
+        mask &= df_all['difficulty'].isin(selected_difficulties)
     
-    # Score filter
-    filtered_history = [q for q in filtered_history if q.get('percentage', 0) >= min_score]
+    filtered_df = df_all[mask].reset_index(drop=True)
     
     st.divider()
     
-    if not filtered_history:
+    if filtered_df.empty:
         st.warning("No quizzes match your current filters. Try adjusting the filter criteria.")
         return
     
     # Summary statistics
     st.subheader("📊 Summary Statistics")
     
-    total_quizzes = len(filtered_history)
-    avg_score = sum(q.get('percentage', 0) for q in filtered_history) / total_quizzes
-    best_score = max(q.get('percentage', 0) for q in filtered_history)
-    total_time = sum(q.get('time_taken', 0) for q in filtered_history)
+    total_quizzes = len(filtered_df)
+    avg_score = filtered_df['percentage'].mean()
+    best_score = filtered_df['percentage'].max()
+    total_time = filtered_df['time_taken'].sum()
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -143,106 +157,61 @@ def main():
     # Charts
     st.subheader("📈 Performance Charts")
     
-    # Convert to DataFrame for easier plotting
-    df = pd.DataFrame(filtered_history)
-    df['completed_at'] = pd.to_datetime(df['completed_at'])
-    df = df.sort_values('completed_at')
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        # Score trend over time
-        fig_trend = px.line(
-            df,
-            x='completed_at',
-            y='percentage',
-            title='Score Trend Over Time',
-            labels={'percentage': 'Score (%)', 'completed_at': 'Date'},
-            markers=True
-        )
-        fig_trend.update_layout(showlegend=False)
-        st.plotly_chart(fig_trend, use_container_width=True)
-    
-    with col2:
-        # Score distribution
-        fig_hist = px.histogram(
-            df,
-            x='percentage',
-            nbins=10,
-            title='Score Distribution',
-            labels={'percentage': 'Score (%)', 'count': 'Number of Quizzes'}
-        )
-        st.plotly_chart(fig_hist, use_container_width=True)
-    
-    col3, col4 = st.columns(2)
-    
-    with col3:
-        # Performance by topic
-        topic_stats = df.groupby('topic')['percentage'].agg(['mean', 'count']).reset_index()
-        topic_stats.columns = ['Topic', 'Average Score', 'Quiz Count']
-        topic_stats = topic_stats.sort_values('Average Score', ascending=True)
-        
-        fig_topics = px.bar(
-            topic_stats,
-            x='Average Score',
-            y='Topic',
-            orientation='h',
-            title='Average Score by Topic',
-            labels={'Average Score': 'Average Score (%)'},
-            color='Average Score',
-            color_continuous_scale='RdYlGn'
-        )
-        st.plotly_chart(fig_topics, use_container_width=True)
-    
-    with col4:
-        # Performance by difficulty
-        diff_stats = df.groupby('difficulty')['percentage'].agg(['mean', 'count']).reset_index()
-        diff_stats.columns = ['Difficulty', 'Average Score', 'Quiz Count']
-        diff_stats['Difficulty'] = diff_stats['Difficulty'].str.title()
-        
-        fig_diff = px.bar(
-            diff_stats,
-            x='Difficulty',
-            y='Average Score',
-            title='Performance by Difficulty',
-            labels={'Average Score': 'Average Score (%)'},
-            color='Average Score',
-            color_continuous_scale='RdYlGn'
-        )
-        st.plotly_chart(fig_diff, use_container_width=True)
+    df = filtered_df.sort_values('completed_dt')
+    
+    # One groupby feeds both bar charts
+    grouped = df.groupby(['topic', 'difficulty'])['percentage'].agg(['sum', 'count'])
+    topic_stats = grouped.groupby(level='topic').sum()
+    topic_stats = (topic_stats['sum'] / topic_stats['count']).sort_values()
+    diff_stats = grouped.groupby(level='difficulty').sum()
+    diff_stats = diff_stats['sum'] / diff_stats['count']
+    
+    # All four charts in one figure, so the browser mounts a single Plotly component
+    fig = make_subplots(
+        rows=2, cols=2,
+        subplot_titles=('Score Trend Over Time', 'Score Distribution',
+                        'Average Score by Topic', 'Performance by Difficulty'),
+        vertical_spacing=0.15
+    )
+    fig.add_trace(go.Scatter(x=df['completed_dt'], y=df['percentage'], mode='lines+markers'), row=1, col=1)
+    fig.add_trace(go.Histogram(x=df['percentage'], nbinsx=10), row=1, col=2)
+    fig.add_trace(go.Bar(
+        x=topic_stats.values,
+        y=topic_stats.index,
+        orientation='h',
+        marker=dict(color=topic_stats.values, colorscale='RdYlGn')
+    ), row=2, col=1)
+    fig.add_trace(go.Bar(
+        x=diff_stats.index.str.title(),
+        y=diff_stats.values,
+        marker=dict(color=diff_stats.values, colorscale='RdYlGn')
+    ), row=2, col=2)
+    
+    fig.update_xaxes(title_text='Date', row=1, col=1)
+    fig.update_yaxes(title_text='Score (%)', row=1, col=1)
+    fig.update_xaxes(title_text='Score (%)', row=1, col=2)
+    fig.update_yaxes(title_text='Number of Quizzes', row=1, col=2)
+    fig.update_xaxes(title_text='Average Score (%)', row=2, col=1)
+    fig.update_yaxes(title_text='Average Score (%)', row=2, col=2)
+    fig.update_layout(height=800, showlegend=False)
+    st.plotly_chart(fig, use_container_width=True)
     
     # Detailed quiz list
     st.subheader("📋 Detailed Quiz List")
     
     # Prepare data for table display
-    table_data = []
-    for i, quiz in enumerate(filtered_history):
-        table_data.append({
-            '#': i + 1,
-            'Date': quiz.get('completed_at', '')[:10],
-            'Time': quiz.get('completed_at', '')[11:16],
-            'Topic': quiz.get('topic', 'Unknown'),
-            'Difficulty': quiz.get('difficulty', 'medium').title(),
-            'Questions': quiz.get('total_questions', 0),
-            'Score': f"{quiz.get('score', 0)}/{quiz.get('total_questions', 0)}",
-            'Percentage': f"{quiz.get('percentage', 0):.1f}%",
-            'Duration': f"{quiz.get('time_taken', 0):.1f}s",
-            'Quiz ID': quiz.get('quiz_id', 'Unknown')
-        })
-    
-    df_table = pd.DataFrame(table_data)
-    
-    # Display table with styling
-    def color_percentage(val):
-        if 'Percentage' in val.name:
-            percentage = float(val.replace('%', ''))
-            if percentage >= 80:
-                return 'background-color: #d4edda'
-            elif percentage >= 60:
-                return 'background-color: #fff3cd'
-            else:
-                return 'background-color: #f8d7da'
-        return ''
+    df_table = pd.DataFrame({
+        '#': filtered_df.index + 1,
+        'Date': filtered_df['date_str'],
+        'Time': filtered_df['time_str'],
+        'Topic': filtered_df['topic'],
+        'Difficulty': filtered_df['difficulty'].str.title(),
+        'Questions': filtered_df['total_questions'],
+        'Score': filtered_df['score'].astype(str) + '/' + filtered_df['total_questions'].astype(str),
+        'Percentage': filtered_df['percentage'].round(1),
+        'Duration': filtered_df['time_taken'].round(1).astype(str) + 's',
+        'Quiz ID': filtered_df['quiz_id']
+    })
     
     # Use column configuration for better display
     column_config = {
@@ -253,7 +222,7 @@ def main():
         'Difficulty': st.column_config.TextColumn("Difficulty", width="medium"),
         'Questions': st.column_config.NumberColumn("Questions", width="small"),
         'Score': st.column_config.TextColumn("Score", width="medium"),
-        'Percentage': st.column_config.ProgressColumn("Score %", min_value=0, max_value=100, width="medium"),
+        'Percentage': st.column_config.ProgressColumn("Score %", format="%.1f%%", min_value=0, max_value=100, width="medium"),
         'Duration': st.column_config.TextColumn("Duration", width="medium"),
         'Quiz ID': st.column_config.TextColumn("Quiz ID", width="medium")
     }
@@ -269,18 +238,20 @@ def main():
     if st.checkbox("Show detailed quiz breakdown"):
         st.subheader("🔍 Quiz Details")
         
-        # Select quiz to view details
-        quiz_options = [f"Quiz {i+1}: {q.get('topic', 'Unknown')} ({q.get('completed_at', '')[:10]})" 
-                       for i, q in enumerate(filtered_history)]
+        # Select quiz to view details, by quiz_id so the choice survives filter changes
+        quiz_options = dict(zip(
+            df_table['Quiz ID'],
+            "Quiz " + df_table['#'].astype(str) + ": " + df_table['Topic'] + " (" + df_table['Date'] + ")"
+        ))
         
-        selected_quiz_idx = st.selectbox(
+        selected_quiz_id = st.selectbox(
             "Select a quiz to view details:",
-            range(len(quiz_options)),
-            format_func=lambda i: quiz_options[i]
+            list(quiz_options),
+            format_func=quiz_options.get
         )
         
-        if selected_quiz_idx is not None:
-            selected_quiz = filtered_history[selected_quiz_idx]
+        if selected_quiz_id is not None:
+            selected_quiz = filtered_df.set_index('quiz_id', drop=False).loc[selected_quiz_id]
             
             # Quiz header
             col1, col2, col3 = st.columns(3)
@@ -288,8 +259,8 @@ def main():
                 st.write(f"**Topic:** {selected_quiz.get('topic', 'Unknown')}")
                 st.write(f"**Difficulty:** {selected_quiz.get('difficulty', 'medium').title()}")
             with col2:
-                st.write(f"**Date:** {selected_quiz.get('completed_at', '')[:10]}")
-                st.write(f"**Time:** {selected_quiz.get('completed_at', '')[11:16]}")
+                st.write(f"**Date:** {selected_quiz['date_str']}")
+                st.write(f"**Time:** {selected_quiz['time_str']}")
             with col3:
                 st.write(f"**Score:** {selected_quiz.get('score', 0)}/{selected_quiz.get('total_questions', 0)}")
                 st.write(f"**Percentage:** {selected_quiz.get('percentage', 0):.1f}%")
@@ -299,28 +270,19 @@ def main():
             user_answers = selected_quiz.get('user_answers', {})
             
             if questions:
-                for i, question in enumerate(questions):
-                    user_answer = user_answers.get(str(i), "Not answered")
-                    correct_answer = question.get('correct_answer', 'Unknown')
-                    is_correct = user_answer == correct_answer
-                    
-                    with st.expander(f"Question {i+1} - {'✅ Correct' if is_correct else '❌ Incorrect'}"):
-                        st.write(f"**Question:** {question['question']}")
+                per_question = build_question_review(questions, user_answers)
+                for i, review in enumerate(per_question):
+                    with st.expander(f"Question {i+1} - {'✅ Correct' if review['is_correct'] else '❌ Incorrect'}"):
+                        st.write(f"**Question:** {review['question']}")
                         
-                        options = question.get('options', {})
-                        for key, value in options.items():
-                            icon = ""
-                            if key == correct_answer:
-                                icon = "✅"
-                            elif key == user_answer and not is_correct:
-                                icon = "❌"
-                            st.write(f"{icon} {key}) {value}")
+                        for line in review['option_lines']:
+                            st.write(line)
                         
-                        st.write(f"**Your answer:** {user_answer}")
-                        st.write(f"**Correct answer:** {correct_answer}")
+                        st.write(f"**Your answer:** {review['user_answer']}")
+                        st.write(f"**Correct answer:** {review['correct_answer']}")
                         
-                        if question.get('explanation'):
-                            st.write(f"**Explanation:** {question['explanation']}")
+                        if review['explanation']:
+                            st.write(f"**Explanation:** {review['explanation']}")
     
     # Action buttons
     st.divider()
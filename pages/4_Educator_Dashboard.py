@@ -1,10 +1,15 @@
 import streamlit as st
+import io
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from dateutil.tz import tzlocal
 from utils.session_manager import SessionManager
-from services.pinecone_service import PineconeService
+from utils.services import load_student_profiles, load_quiz_histories, clear_student_caches, get_classroom_service
 
 st.set_page_config(
     page_title="Educator Dashboard - EduTutor AI",
@@ -12,120 +17,117 @@ st.set_page_config(
     layout="wide"
 )
 
-def main():
-    """Educator Dashboard main function"""
-    st.title("👨‍🏫 Educator Dashboard")
-    
-    # Initialize services
-    session_manager = SessionManager()
-    pinecone_service = PineconeService()
-    
-    # Check authentication
-    if not session_manager.is_authenticated():
-        st.error("Please log in to access the educator dashboard.")
-        st.stop()
-    
-    user_info = session_manager.get_user_info()
-    
-    # Check if user is an educator
-    if user_info.get('role') != 'educator':
-        st.error("This dashboard is only available for educators.")
-        st.stop()
-    
-    st.subheader(f"Welcome, {user_info.get('name', user_info['user_id'])}!")
-    st.write("Monitor student progress and analyze learning analytics.")
-    
-    # Get all student profiles
-    with st.spinner("Loading student data..."):
-        student_profiles = pinecone_service.get_all_student_profiles()
-    
-    if not student_profiles:
-        st.info("No student data available yet. Students need to create profiles and take quizzes for data to appear here.")
-        return
-    
-    # Overview metrics
-    st.subheader("📊 Overview")
-    
-    total_students = len(student_profiles)
-    active_students = len([s for s in student_profiles if s.get('quiz_count', 0) > 0])
-    total_quizzes = sum(s.get('quiz_count', 0) for s in student_profiles)
-    avg_performance = sum(s.get('average_score', 0) for s in student_profiles) / total_students if total_students > 0 else 0
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.metric("Total Students", total_students)
-    
-    with col2:
-        st.metric("Active Students", active_students)
-    
-    with col3:
-        st.metric("Total Quizzes", total_quizzes)
-    
-    with col4:
-        st.metric("Avg Performance", f"{avg_performance:.1f}%")
-    
-    # Student performance analysis
-    st.divider()
-    st.subheader("📈 Student Performance Analysis")
-    
-    # Convert to DataFrame for easier analysis
-    df_students = pd.DataFrame(student_profiles)
-    df_students['created_at'] = pd.to_datetime(df_students['created_at'])
-    
-    # Performance distribution
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        # Score distribution
-        if not df_students.empty and 'average_score' in df_students.columns:
-            fig_dist = px.histogram(
-                df_students[df_students['average_score'] > 0],
-                x='average_score',
-                nbins=10,
-                title='Student Score Distribution',
-                labels={'average_score': 'Average Score (%)', 'count': 'Number of Students'}
-            )
-            st.plotly_chart(fig_dist, use_container_width=True)
-    
-    with col2:
-        # Activity levels
-        activity_data = df_students['quiz_count'].value_counts().sort_index()
-        fig_activity = px.bar(
-            x=activity_data.index,
-            y=activity_data.values,
-            title='Student Activity Levels',
-            labels={'x': 'Number of Quizzes Taken', 'y': 'Number of Students'}
-        )
-        st.plotly_chart(fig_activity, use_container_width=True)
-    
-    # Student registration over time
-    col3, col4 = st.columns(2)
-    
-    with col3:
-        # Registration trend
-        df_students['month'] = df_students['created_at'].dt.to_period('M')
-        monthly_registrations = df_students['month'].value_counts().sort_index()
-        
-        fig_reg = px.line(
-            x=[str(m) for m in monthly_registrations.index],
-            y=monthly_registrations.values,
-            title='Student Registration Trend',
-            labels={'x': 'Month', 'y': 'New Registrations'},
-            markers=True
-        )
-        st.plotly_chart(fig_reg, use_container_width=True)
-    
-    with col4:
-        # Learning levels
-        level_counts = df_students['learning_level'].value_counts()
-        fig_levels = px.pie(
-            values=level_counts.values,
-            names=level_counts.index,
-            title='Student Learning Levels'
-        )
-        st.plotly_chart(fig_levels, use_container_width=True)
-    
+# Profile fields the dashboard reads; nested google_info/course data is left out
+STUDENT_COLUMNS = [
+    'user_id', 'name', 'email', 'quiz_count', 'average_score', 'total_score', 'learning_level',
+    'created_at', 'created_at_ms', 'updated_at', 'updated_at_ms'
+]
+
+def to_local_datetime(df, column):
+    """`column` as naive local datetimes, from its epoch-ms copy where stored and the ISO string otherwise"""
+    ms_column = f"{column}_ms"
+    if ms_column in df:
+        # tzlocal applies the offset in effect at each instant, so dates across a DST change stay put
+        parsed = pd.to_datetime(df[ms_column], unit='ms', utc=True).dt.tz_convert(tzlocal()).dt.tz_localize(None)
+        parsed = parsed.astype('datetime64[ns]')
+    else:
+        parsed = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    
+    # Records written before the numeric copies existed still need parsing; their
+    # ISO strings are already naive local time
+    missing = parsed.isna()
+    if missing.any():
+        iso = pd.to_datetime(df.loc[missing, column], format='ISO8601', errors='coerce')
+        parsed = parsed.fillna(iso.astype('datetime64[ns]'))
+    return parsed
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def build_student_frames(student_profiles):
+    """Students DataFrame plus the summary counts behind the charts, rebuilt only when profiles change"""
+    df_students = pd.DataFrame(student_profiles, columns=STUDENT_COLUMNS)
+    # Arrow-backed strings: contiguous UTF-8 buffers and compiled .str methods
+    text_columns = ['user_id', 'name', 'email']
+    df_students[text_columns] = df_students[text_columns].astype('string[pyarrow]')
+    df_students['created_at'] = to_local_datetime(df_students, 'created_at')
+    df_students['updated_at'] = to_local_datetime(df_students, 'updated_at')
+    # Only a few distinct levels, so counting and filtering work on category codes
+    df_students['learning_level'] = df_students['learning_level'].fillna('beginner').astype('category')
+    df_students['month'] = df_students['created_at'].dt.to_period('M')
+    
+    activity_data = df_students['quiz_count'].value_counts().sort_index()
+    monthly_registrations = df_students['month'].value_counts().sort_index()
+    level_counts = df_students['learning_level'].value_counts()
+    # Original profile per user_id, so picking a student is a dict lookup and
+    # missing fields stay absent for the drill-down's .get defaults (not NaN)
+    students_by_id = {profile.get('user_id'): profile for profile in student_profiles}
+    
+    return df_students, activity_data, monthly_registrations, level_counts, students_by_id
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def build_overview_figures(student_profiles):
+    """The class-wide Plotly charts, rebuilt only when profiles change"""
+    df_students, _, _, level_counts, _ = build_student_frames(student_profiles)
+    
+    fig_dist = px.histogram(
+        df_students[df_students['average_score'] > 0],
+        x='average_score',
+        nbins=10,
+        title='Student Score Distribution',
+        labels={'average_score': 'Average Score (%)', 'count': 'Number of Students'}
+    )
+    fig_levels = px.pie(
+        values=level_counts.values,
+        names=level_counts.index,
+        title='Student Learning Levels'
+    )
+    return fig_dist, fig_levels
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def build_student_figures(student_name, df_quiz):
+    """Trend and topic charts for one student; only the columns they plot feed the cache key"""
+    fig_trend = px.line(
+        df_quiz,
+        x='completed_at',
+        y='percentage',
+        title=f'{student_name} - Performance Trend',
+        labels={'percentage': 'Score (%)', 'completed_at': 'Date'},
+        markers=True
+    )
+    
+    # Per-topic mean as one pass over factorized codes
+    codes, topics = pd.factorize(df_quiz['topic'], sort=True)
+    valid = codes >= 0
+    totals = np.bincount(codes[valid], weights=df_quiz['percentage'].to_numpy()[valid], minlength=len(topics))
+    counts = np.bincount(codes[valid], minlength=len(topics))
+    topic_performance = pd.DataFrame({'topic': topics, 'percentage': totals / counts})
+    fig_topics = px.bar(
+        topic_performance,
+        x='topic',
+        y='percentage',
+        title=f'{student_name} - Topic Performance',
+        labels={'percentage': 'Average Score (%)', 'topic': 'Topic'}
+    )
+    fig_topics.update_xaxes(tickangle=45)
+    return fig_trend, fig_topics
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def to_csv_bytes(df):
+    """CSV export encoded by pyarrow's writer straight to bytes, reused until the table changes"""
+    buffer = io.BytesIO()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return buffer.getvalue()
+
+# Sort choices and the (column, ascending) they sort by
+SORT_MAP = {
+    "Name": ('name', True),
+    "Quiz Count": ('quiz_count', False),
+    "Average Score": ('average_score', False),
+    "Registration Date": ('created_at', False)
+}
+
+@st.fragment
+def student_details_section(df_students, students_by_id):
+    """Filters, table and per-student drill-down; widget changes here rerun only this section"""
     # Detailed student list
     st.divider()
     st.subheader("👥 Student Details")
@@ -137,51 +139,41 @@ def main():
         min_quizzes = st.slider("Minimum Quizzes Taken", 0, max(df_students['quiz_count']) if not df_students.empty else 10, 0)
     
     with col2:
-        learning_levels = df_students['learning_level'].unique() if not df_students.empty else ['beginner']
+        learning_levels = df_students['learning_level'].cat.categories.tolist() if not df_students.empty else ['beginner']
         selected_levels = st.multiselect("Learning Levels", learning_levels, default=learning_levels)
     
     with col3:
-        sort_by = st.selectbox("Sort By", ["Name", "Quiz Count", "Average Score", "Registration Date"])
+        sort_by = st.selectbox("Sort By", list(SORT_MAP))
     
-    # Apply filters
+    # Apply filters and sort in one pass; sort_values already returns a new frame
+    sort_column, ascending = SORT_MAP[sort_by]
     filtered_students = df_students[
         (df_students['quiz_count'] >= min_quizzes) &
         (df_students['learning_level'].isin(selected_levels))
-    ].copy()
-    
-    # Sort students
-    if sort_by == "Name":
-        filtered_students = filtered_students.sort_values('name')
-    elif sort_by == "Quiz Count":
-        filtered_students = filtered_students.sort_values('quiz_count', ascending=False)
-    elif sort_by == "Average Score":
-        filtered_students = filtered_students.sort_values('average_score', ascending=False)
-    elif sort_by == "Registration Date":
-        filtered_students = filtered_students.sort_values('created_at', ascending=False)
+    ].sort_values(sort_column, ascending=ascending)
     
     # Display student table
     if not filtered_students.empty:
-        # Prepare table data
-        table_data = []
-        for _, student in filtered_students.iterrows():
-            table_data.append({
-                'Name': student.get('name', 'Unknown'),
-                'Email': student.get('email', 'N/A'),
-                'Quizzes': student.get('quiz_count', 0),
-                'Avg Score': f"{student.get('average_score', 0):.1f}%",
-                'Level': student.get('learning_level', 'beginner').title(),
-                'Registered': student.get('created_at').strftime('%Y-%m-%d') if pd.notna(student.get('created_at')) else 'Unknown',
-                'Last Active': student.get('updated_at', '')[:10] if student.get('updated_at') else 'Unknown'
-            })
+        # Prepare table data, a column at a time
+        df_table = pd.DataFrame({
+            'Name': filtered_students['name'].fillna('Unknown'),
+            'Email': filtered_students['email'].fillna('N/A'),
+            'Quizzes': filtered_students['quiz_count'].fillna(0).astype(int),
+            'Avg Score': filtered_students['average_score'].fillna(0).round(1),
+            'Level': filtered_students['learning_level'].astype(str).str.title(),
+            'Registered': filtered_students['created_at'].dt.strftime('%Y-%m-%d').fillna('Unknown'),
+            'Last Active': filtered_students['updated_at'].dt.strftime('%Y-%m-%d').fillna('Unknown')
+        })
         
-        df_table = pd.DataFrame(table_data)
+        # Kept for the export below the fragment, which reruns without this section
+        st.session_state.educator_student_table = df_table
         
         # Column configuration
         column_config = {
             'Name': st.column_config.TextColumn("Student Name", width="large"),
             'Email': st.column_config.TextColumn("Email", width="large"),
             'Quizzes': st.column_config.NumberColumn("Quizzes Taken", width="small"),
-            'Avg Score': st.column_config.ProgressColumn("Avg Score", min_value=0, max_value=100, width="medium"),
+            'Avg Score': st.column_config.ProgressColumn("Avg Score", format="%.1f%%", min_value=0, max_value=100, width="medium"),
             'Level': st.column_config.TextColumn("Level", width="medium"),
             'Registered': st.column_config.DateColumn("Registered", width="medium"),
             'Last Active': st.column_config.DateColumn("Last Active", width="medium")
@@ -196,17 +188,26 @@ def main():
         
         # Individual student analysis
         if st.checkbox("View individual student details"):
-            student_names = [f"{s.get('name', 'Unknown')} ({s.get('email', 'N/A')})" 
-                           for _, s in filtered_students.iterrows()]
+            student_names = dict(zip(
+                filtered_students['user_id'],
+                df_table['Name'] + " (" + df_table['Email'] + ")"
+            ))
+            
+            # One query covers every listed student, so switching students doesn't re-query
+            quiz_counts = filtered_students['quiz_count'].fillna(0).astype(int)
+            quiz_histories = load_quiz_histories(dict(zip(
+                filtered_students['user_id'][quiz_counts > 0], quiz_counts[quiz_counts > 0]
+            )))
             
-            selected_student_idx = st.selectbox(
+            # Keyed by user_id, so the choice survives filter and sort changes
+            selected_student_id = st.selectbox(
                 "Select a student:",
-                range(len(student_names)),
-                format_func=lambda i: student_names[i]
+                list(student_names),
+                format_func=student_names.get
             )
             
-            if selected_student_idx is not None:
-                selected_student = filtered_students.iloc[selected_student_idx]
+            if selected_student_id is not None:
+                selected_student = students_by_id[selected_student_id]
                 
                 st.subheader(f"📊 {selected_student.get('name', 'Unknown')} - Detailed Analysis")
                 
@@ -229,39 +230,26 @@ def main():
                 # Get student's quiz history
                 student_id = selected_student.get('user_id')
                 if student_id:
-                    quiz_history = pinecone_service.get_quiz_history(student_id)
+                    quiz_history = quiz_histories.get(student_id, [])
                     
                     if quiz_history:
                         # Convert to DataFrame
                         df_quiz = pd.DataFrame(quiz_history)
-                        df_quiz['completed_at'] = pd.to_datetime(df_quiz['completed_at'])
+                        df_quiz['completed_at'] = to_local_datetime(df_quiz, 'completed_at')
                         df_quiz = df_quiz.sort_values('completed_at')
+                        fig_trend, fig_topics = build_student_figures(
+                            selected_student.get("name", "Student"),
+                            df_quiz[['completed_at', 'topic', 'percentage']]
+                        )
                         
                         col1, col2 = st.columns(2)
                         
                         with col1:
                             # Performance trend
-                            fig_trend = px.line(
-                                df_quiz,
-                                x='completed_at',
-                                y='percentage',
-                                title=f'{selected_student.get("name", "Student")} - Performance Trend',
-                                labels={'percentage': 'Score (%)', 'completed_at': 'Date'},
-                                markers=True
-                            )
                             st.plotly_chart(fig_trend, use_container_width=True)
                         
                         with col2:
                             # Topic performance
-                            topic_performance = df_quiz.groupby('topic')['percentage'].mean().reset_index()
-                            fig_topics = px.bar(
-                                topic_performance,
-                                x='topic',
-                                y='percentage',
-                                title=f'{selected_student.get("name", "Student")} - Topic Performance',
-                                labels={'percentage': 'Average Score (%)', 'topic': 'Topic'}
-                            )
-                            fig_topics.update_xaxis(tickangle=45)
                             st.plotly_chart(fig_topics, use_container_width=True)
                         
                         # Recent quiz results
@@ -282,7 +270,104 @@ def main():
                     else:
                         st.info("No quiz history available for this student.")
     else:
+        st.session_state.educator_student_table = pd.DataFrame()
         st.info("No students match the current filter criteria.")
+
+def main():
+    """Educator Dashboard main function"""
+    st.title("👨‍🏫 Educator Dashboard")
+    
+    # Initialize services
+    session_manager = SessionManager()
+    
+    # Check authentication
+    if not session_manager.is_authenticated():
+        st.error("Please log in to access the educator dashboard.")
+        st.stop()
+    
+    user_info = session_manager.get_user_info()
+    
+    # Check if user is an educator
+    if user_info.get('role') != 'educator':
+        st.error("This dashboard is only available for educators.")
+        st.stop()
+    
+    st.subheader(f"Welcome, {user_info.get('name', user_info['user_id'])}!")
+    st.write("Monitor student progress and analyze learning analytics.")
+    
+    if st.button("🔄 Refresh Data", help="Reload student data instead of using the copy from the last minute"):
+        clear_student_caches()
+    
+    # Get all student profiles (cached, so filter changes don't re-query Pinecone)
+    with st.spinner("Loading student data..."):
+        student_profiles = load_student_profiles()
+    
+    if not student_profiles:
+        st.info("No student data available yet. Students need to create profiles and take quizzes for data to appear here.")
+        return
+    
+    # Convert to DataFrame for easier analysis
+    df_students, activity_data, monthly_registrations, _, students_by_id = build_student_frames(student_profiles)
+    
+    # Overview metrics
+    st.subheader("📊 Overview")
+    
+    quiz_counts = df_students['quiz_count'].fillna(0)
+    total_students = len(df_students)
+    active_students = int((quiz_counts > 0).sum())
+    total_quizzes = int(quiz_counts.sum())
+    avg_performance = float(df_students['average_score'].fillna(0).mean())
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("Total Students", total_students)
+    
+    with col2:
+        st.metric("Active Students", active_students)
+    
+    with col3:
+        st.metric("Total Quizzes", total_quizzes)
+    
+    with col4:
+        st.metric("Avg Performance", f"{avg_performance:.1f}%")
+    
+    # Student performance analysis
+    st.divider()
+    st.subheader("📈 Student Performance Analysis")
+    
+    # Plotly charts are cached, so filter changes below reuse them as-is
+    fig_dist, fig_levels = build_overview_figures(student_profiles)
+    
+    # Performance distribution
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        # Score distribution
+        st.plotly_chart(fig_dist, use_container_width=True)
+    
+    with col2:
+        # Activity levels (plain counts, so the built-in chart is enough)
+        st.markdown("**Student Activity Levels**")
+        st.bar_chart(activity_data, x_label="Number of Quizzes Taken", y_label="Number of Students")
+    
+    # Student registration over time
+    col3, col4 = st.columns(2)
+    
+    with col3:
+        # Registration trend
+        st.markdown("**Student Registration Trend**")
+        st.line_chart(
+            monthly_registrations.set_axis(monthly_registrations.index.astype(str)),
+            x_label="Month",
+            y_label="New Registrations"
+        )
+    
+    with col4:
+        # Learning levels
+        st.plotly_chart(fig_levels, use_container_width=True)
+    
+    student_details_section(df_students, students_by_id)
     
     # Google Classroom integration for educators
     if user_info.get('login_method') == 'google':
@@ -294,8 +379,7 @@ def main():
         with col1:
             if st.button("Sync Google Classroom Data", type="primary"):
                 try:
-                    from services.classroom_service import ClassroomService
-                    classroom_service = ClassroomService()
+                    classroom_service = get_classroom_service()
                     
                     with st.spinner("Syncing classroom data..."):
                         sync_data = classroom_service.sync_classroom_data(user_info['user_id'])
@@ -309,8 +393,10 @@ def main():
                             total_assignments = sum(len(work) for work in sync_data.get('coursework', {}).values())
                             
                             st.write(f"**Synced:** {len(courses)} courses, {total_students} students, {total_assignments} assignments")
+                            if sync_data['failed_courses']:
+                                st.warning(f"Some rosters or coursework could not be fetched for {len(sync_data['failed_courses'])} course(s).")
                         else:
-                            st.error("Failed to sync Google Classroom data.")
+                            st.error("Failed to sync Google Classroom data. Make sure you are logged in with Google and try again.")
                 except Exception as e:
                     st.error(f"Sync failed: {str(e)}")
         
@@ -325,8 +411,9 @@ def main():
     
     with col1:
         if st.button("Export Student List", use_container_width=True):
+            df_table = st.session_state.get('educator_student_table', pd.DataFrame())
             if not df_table.empty:
-                csv_data = df_table.to_csv(index=False)
+                csv_data = to_csv_bytes(df_table)
                 st.download_button(
                     label="Download CSV",
                     data=csv_data,
@@ -1,8 +1,21 @@
-import streamlit as st
-from googleapiclient.discovery import build
-from auth.google_auth import GoogleAuth
+import logging
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from auth.google_auth import GoogleAuth, get_discovery_doc
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Only request the fields the formatters below keep
+COURSE_FIELDS = ('nextPageToken,courses(id,name,section,description,room,ownerId,creationTime,'
+                 'updateTime,enrollmentCode,courseState,alternateLink)')
+STUDENT_FIELDS = 'nextPageToken,students(userId,studentId,profile(emailAddress,name/fullName,photoUrl))'
+COURSEWORK_FIELDS = ('nextPageToken,courseWork(id,title,description,state,alternateLink,creationTime,'
+                     'updateTime,dueDate,dueTime,maxPoints,workType,submissionModificationMode)')
+PAGE_SIZE = 100
+HTTP_TIMEOUT = 10
+
 class ClassroomService:
     """Handle Google Classroom API interactions"""
     
@@ -16,11 +29,15 @@ class ClassroomService:
         try:
             credentials = self.google_auth.get_credentials_from_session()
             if credentials:
-                self.service = build('classroom', 'v1', credentials=credentials)
+                # One long-lived connection per service, reused by every call and batch;
+                # deliberately no httplib2 disk cache, since responses hold student data
+                http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+                # Reuse the parsed discovery document instead of fetching it per build
+                self.service = build_from_document(get_discovery_doc('classroom', 'v1'), http=http)
             else:
-                st.warning("Google credentials not found. Please log in with Google first.")
-        except Exception as e:
-            st.error(f"Failed to initialize Classroom service: {str(e)}")
+                logger.warning("Google credentials not found; Classroom service not initialized")
+        except Exception:
+            logger.exception("Failed to initialize Classroom service")
     
     def get_courses(self):
         """Get all courses for the authenticated user"""
@@ -28,8 +45,11 @@ class ClassroomService:
             if not self.service:
                 return None
             
-            results = self.service.courses().list().execute()
-            courses = results.get('courses', [])
+            courses = self._list_all(
+                self.service.courses(),
+                'courses',
+                fields=COURSE_FIELDS
+            )
             
             # Format course data
             formatted_courses = []
@@ -49,8 +69,8 @@ class ClassroomService:
                 })
             
             return formatted_courses
-        except Exception as e:
-            st.error(f"Failed to fetch courses: {str(e)}")
+        except Exception:
+            logger.exception("Failed to fetch courses")
             return None
     
     def get_students(self, course_id):
@@ -59,25 +79,15 @@ class ClassroomService:
             if not self.service:
                 return None
             
-            results = self.service.courses().students().list(courseId=course_id).execute()
-            students = results.get('students', [])
-            
-            # Format student data
-            formatted_students = []
-            for student in students:
-                profile = student.get('profile', {})
-                formatted_students.append({
-                    'course_id': course_id,
-                    'user_id': student.get('userId'),
-                    'email': profile.get('emailAddress'),
-                    'name': profile.get('name', {}).get('fullName', ''),
-                    'photo_url': profile.get('photoUrl', ''),
-                    'student_id': student.get('studentId')
-                })
-            
-            return formatted_students
-        except Exception as e:
-            st.error(f"Failed to fetch students for course {course_id}: {str(e)}")
+            students = self._list_all(
+                self.service.courses().students(),
+                'students',
+                courseId=course_id,
+                fields=STUDENT_FIELDS
+            )
+            return self._format_students(course_id, students)
+        except Exception:
+            logger.exception("Failed to fetch students for course %s", course_id)
             return None
     
     def get_course_work(self, course_id):
@@ -86,65 +96,142 @@ class ClassroomService:
             if not self.service:
                 return None
             
-            results = self.service.courses().courseWork().list(courseId=course_id).execute()
-            coursework = results.get('courseWork', [])
-            
-            # Format coursework data
-            formatted_coursework = []
-            for work in coursework:
-                formatted_coursework.append({
-                    'course_id': course_id,
-                    'id': work.get('id'),
-                    'title': work.get('title'),
-                    'description': work.get('description', ''),
-                    'materials': work.get('materials', []),
-                    'state': work.get('state'),
-                    'alternate_link': work.get('alternateLink'),
-                    'creation_time': work.get('creationTime'),
-                    'update_time': work.get('updateTime'),
-                    'due_date': work.get('dueDate'),
-                    'due_time': work.get('dueTime'),
-                    'max_points': work.get('maxPoints'),
-                    'work_type': work.get('workType'),
-                    'submission_modification_mode': work.get('submissionModificationMode')
-                })
-            
-            return formatted_coursework
-        except Exception as e:
-            st.error(f"Failed to fetch coursework for course {course_id}: {str(e)}")
+            coursework = self._list_all(
+                self.service.courses().courseWork(),
+                'courseWork',
+                courseId=course_id,
+                fields=COURSEWORK_FIELDS
+            )
+            return self._format_coursework(course_id, coursework)
+        except Exception:
+            logger.exception("Failed to fetch coursework for course %s", course_id)
             return None
     
+    def _list_all(self, collection, key, **kwargs):
+        """Run a list call and follow nextPageToken until every page is read"""
+        items = []
+        request = collection.list(pageSize=PAGE_SIZE, **kwargs)
+        while request is not None:
+            response = request.execute()
+            items.extend(response.get(key, []))
+            request = collection.list_next(request, response)
+        return items
+    
+    def _format_students(self, course_id, students):
+        """Format student data"""
+        formatted_students = []
+        for student in students:
+            profile = student.get('profile', {})
+            formatted_students.append({
+                'course_id': course_id,
+                'user_id': student.get('userId'),
+                'email': profile.get('emailAddress'),
+                'name': profile.get('name', {}).get('fullName', ''),
+                'photo_url': profile.get('photoUrl', ''),
+                'student_id': student.get('studentId')
+            })
+        
+        return formatted_students
+    
+    def _format_coursework(self, course_id, coursework):
+        """Format coursework data"""
+        formatted_coursework = []
+        for work in coursework:
+            formatted_coursework.append({
+                'course_id': course_id,
+                'id': work.get('id'),
+                'title': work.get('title'),
+                'description': work.get('description', ''),
+                'state': work.get('state'),
+                'alternate_link': work.get('alternateLink'),
+                'creation_time': work.get('creationTime'),
+                'update_time': work.get('updateTime'),
+                'due_date': work.get('dueDate'),
+                'due_time': work.get('dueTime'),
+                'max_points': work.get('maxPoints'),
+                'work_type': work.get('workType'),
+                'submission_modification_mode': work.get('submissionModificationMode')
+            })
+        
+        return formatted_coursework
+    
     def sync_classroom_data(self, user_id):
-        """Sync all classroom data for a user"""
+        """Sync all classroom data for a user; returns None on failure, with details in the log"""
         try:
             sync_data = {
                 'user_id': user_id,
                 'sync_time': datetime.now().isoformat(),
                 'courses': [],
                 'students': {},
-                'coursework': {}
+                'coursework': {},
+                'failed_courses': []
             }
             
             # Get all courses
             courses = self.get_courses()
+            if courses is None:
+                return None
             if courses:
                 sync_data['courses'] = courses
                 
-                # For each course, get students and coursework
-                for course in courses:
-                    course_id = course['id']
-                    
-                    # Get students
-                    students = self.get_students(course_id)
-                    if students:
-                        sync_data['students'][course_id] = students
-                    
-                    # Get coursework
-                    coursework = self.get_course_work(course_id)
-                    if coursework:
-                        sync_data['coursework'][course_id] = coursework
+                # For each course, get students and coursework via batched requests
+                self._batch_fetch_rosters(courses, sync_data)
             
             return sync_data
-        except Exception as e:
-            st.error(f"Failed to sync classroom data: {str(e)}")
+        except Exception:
+            logger.exception("Failed to sync classroom data for %s", user_id)
             return None
+    
+    def _batch_fetch_rosters(self, courses, sync_data):
+        """Fetch students and coursework for every course in as few HTTP round trips as possible"""
+        students = {course['id']: [] for course in courses}
+        coursework = {course['id']: [] for course in courses}
+        
+        pending = {}
+        for course in courses:
+            course_id = course['id']
+            pending[f"students:{course_id}"] = self.service.courses().students().list(
+                courseId=course_id, pageSize=PAGE_SIZE, fields=STUDENT_FIELDS)
+            pending[f"coursework:{course_id}"] = self.service.courses().courseWork().list(
+                courseId=course_id, pageSize=PAGE_SIZE, fields=COURSEWORK_FIELDS)
+        
+        failed_courses = set()
+        
+        # Each round batches the outstanding requests; later rounds only fetch further pages
+        while pending:
+            next_pages = {}
+            
+            def callback(request_id, response, exception):
+                kind, course_id = request_id.split(':', 1)
+                if exception is not None:
+                    # Logged per request; the caller reports the failed courses once the sync ends
+                    logger.warning("Failed to fetch %s for course %s: %s", kind, course_id, exception)
+                    failed_courses.add(course_id)
+                    return
+                if kind == 'students':
+                    students[course_id].extend(response.get('students', []))
+                    collection = self.service.courses().students()
+                else:
+                    coursework[course_id].extend(response.get('courseWork', []))
+                    collection = self.service.courses().courseWork()
+                next_request = collection.list_next(pending[request_id], response)
+                if next_request is not None:
+                    next_pages[request_id] = next_request
+            
+            # Classroom accepts at most 50 calls per batch
+            request_ids = list(pending)
+            for start in range(0, len(request_ids), 50):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for request_id in request_ids[start:start + 50]:
+                    batch.add(pending[request_id], request_id=request_id)
+                batch.execute()
+            
+            pending = next_pages
+        
+        sync_data['failed_courses'] = sorted(failed_courses)
+        
+        for course_id in students:
+            if students[course_id]:
+                sync_data['students'][course_id] = self._format_students(course_id, students[course_id])
+            if coursework[course_id]:
+                sync_data['coursework'][course_id] = self._format_coursework(course_id, coursework[course_id])
@@ -0,0 +1,60 @@
+import os
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, List, Any
+
+class QuizHistoryCache:
+    """On-disk copy of each user's quiz history, topped up from Pinecone with only newer quizzes"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv(
+            "EDUTUTOR_HISTORY_CACHE",
+            os.path.join(os.path.expanduser("~"), ".edututor", "history.db")
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS quiz_history (
+                    user_id TEXT NOT NULL,
+                    quiz_id TEXT NOT NULL,
+                    completed_at TEXT,
+                    completed_at_ms INTEGER,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (user_id, quiz_id)
+                )
+            """)
+    
+    def sync(self, user_id: str, pinecone_service, limit: int = 1000) -> int:
+        """Pull quizzes completed since the newest cached one; returns how many were fetched"""
+        with closing(sqlite3.connect(self.path)) as conn:
+            row = conn.execute(
+                "SELECT MAX(completed_at_ms) FROM quiz_history WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        
+        # History is append-only, so only the delta needs fetching. The cutoff is
+        # inclusive; re-fetched quizzes are deduplicated on quiz_id below.
+        since = datetime.fromtimestamp(row[0] / 1000) if row[0] is not None else None
+        new_quizzes = pinecone_service.get_quiz_history(user_id, limit=limit, since=since)
+        
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO quiz_history VALUES (?, ?, ?, ?, ?)",
+                [(user_id, quiz['quiz_id'], quiz.get('completed_at', ''), quiz.get('completed_at_ms'),
+                  json.dumps(quiz)) for quiz in new_quizzes]
+            )
+        return len(new_quizzes)
+    
+    def load(self, user_id: str, limit: int = 100, since: datetime = None) -> List[Dict[str, Any]]:
+        """Cached quizzes for a user, newest first, optionally only those completed since `since`"""
+        query = "SELECT record FROM quiz_history WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            query += " AND completed_at >= ?"
+            params.append(since.isoformat())
+        query += " ORDER BY completed_at DESC LIMIT ?"
+        params.append(limit)
+        
+        with closing(sqlite3.connect(self.path)) as conn:
+            return [json.loads(record) for (record,) in conn.execute(query, params)]
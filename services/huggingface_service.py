@@ -1,9 +1,44 @@
 import os
-import requests
+import re
+import logging
+import time
+import random
+import asyncio
+import httpx
 import json
 import streamlit as st
 from typing import List, Dict, Any
 
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    json_dumps, json_loads = orjson.dumps, orjson.loads
+except ImportError:
+    # Same interface on bytes with the standard library
+    json_dumps, json_loads = (lambda obj: json.dumps(obj).encode()), json.loads
+
+# Transient inference API statuses (rate limiting, model still loading) worth retrying
+RETRY_STATUSES = {429, 502, 503, 504}
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+# Option letters accepted by the line parser
+OPTION_KEYS = frozenset('ABCD')
+
+# One well-formed question block, matched in a single pass
+QUIZ_PATTERN = re.compile(
+    r'^[ \t]*Question:[ \t]*(?P<q>[^\n]+?)[ \t]*\n'
+    r'[ \t]*A\)[ \t]*(?P<a>[^\n]*?)[ \t]*\n'
+    r'[ \t]*B\)[ \t]*(?P<b>[^\n]*?)[ \t]*\n'
+    r'[ \t]*C\)[ \t]*(?P<c>[^\n]*?)[ \t]*\n'
+    r'[ \t]*D\)[ \t]*(?P<d>[^\n]*?)[ \t]*\n'
+    r'[ \t]*Correct Answer:[ \t]*(?P<ca>[ABCD])[^\n]*\n'
+    r'[ \t]*Explanation:[ \t]*(?P<ex>[^\n]*?)[ \t]*$',
+    re.MULTILINE
+)
+
 class HuggingFaceService:
     """Handle Hugging Face API interactions for quiz generation"""
     
@@ -11,28 +46,61 @@ class HuggingFaceService:
         self.api_key = os.getenv("HUGGINGFACE_API_KEY", "your_huggingface_api_key")
         self.base_url = "https://api-inference.huggingface.co/models"
         self.headers = {"Authorization": f"Bearer {self.api_key}"}
+        # HTTP/2 client: the concurrent per-question requests multiplex over one connection
+        self.client = httpx.Client(
+            http2=True,
+            headers={**self.headers, "Content-Type": "application/json"},
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+            timeout=httpx.Timeout(30.0, connect=3.05)
+        )
         # Using a capable text generation model
         self.model_id = "microsoft/DialoGPT-large"
     
-    def generate_quiz_questions(self, topic: str, difficulty: str = "medium", num_questions: int = 5) -> List[Dict[str, Any]]:
-        """Generate quiz questions using Hugging Face API"""
+    def generate_quiz_questions(self, topic: str, difficulty: str = "medium", num_questions: int = 5,
+                                fallback: bool = True) -> List[Dict[str, Any]]:
+        """Generate quiz questions using Hugging Face API; on failure return generic questions, or raise if not fallback"""
         try:
-            # Create a detailed prompt for quiz generation
-            prompt = self._create_quiz_prompt(topic, difficulty, num_questions)
-            
-            # Make API request
-            response = self._make_api_request(prompt)
-            
-            if response:
-                # Parse the response into structured quiz questions
-                questions = self._parse_quiz_response(response, num_questions)
-                return questions
-            else:
-                return self._generate_fallback_quiz(topic, num_questions)
-                
+            return asyncio.run(self.agenerate_quiz_questions(topic, difficulty, num_questions))
         except Exception as e:
-            st.error(f"Failed to generate quiz questions: {str(e)}")
-            return self._generate_fallback_quiz(topic, num_questions)
+            if not fallback:
+                raise
+            logger.exception("Failed to generate quiz questions")
+            st.warning(f"Failed to generate quiz questions: {str(e)}")
+            return self.generate_fallback_quiz(topic, num_questions)
+    
+    async def agenerate_quiz_questions(self, topic: str, difficulty: str = "medium", num_questions: int = 5) -> List[Dict[str, Any]]:
+        """Generate quiz questions with one concurrent API request per question; raises if none could be generated"""
+        # Create a detailed prompt for a single question
+        prompt = self._create_quiz_prompt(topic, difficulty, 1)
+        
+        # Make API requests in parallel worker threads
+        responses = await asyncio.gather(
+            *[asyncio.to_thread(self._make_api_request, prompt) for _ in range(num_questions)],
+            return_exceptions=True
+        )
+        
+        # Parse the responses into structured quiz questions
+        questions = []
+        seen = set()
+        for response in responses:
+            if isinstance(response, Exception) or not response:
+                continue
+            for question in self._parse_quiz_response(response)[:1]:
+                # Sampling can repeat a question across requests
+                if question['question'] not in seen:
+                    seen.add(question['question'])
+                    questions.append(question)
+        
+        if questions:
+            return questions
+        
+        # Raised here rather than reported, since st.* calls from worker threads are dropped
+        errors = [response for response in responses if isinstance(response, Exception)]
+        for error in errors:
+            logger.warning("Quiz generation request failed: %s", error)
+        if errors:
+            raise RuntimeError(f"API request failed: {str(errors[0])}")
+        raise RuntimeError("The API returned no usable questions.")
     
     def _create_quiz_prompt(self, topic: str, difficulty: str, num_questions: int) -> str:
         """Create a structured prompt for quiz generation"""
@@ -56,79 +124,93 @@ Questions:
         return prompt
     
     def _make_api_request(self, prompt: str) -> str:
-        """Make API request to Hugging Face"""
-        try:
-            # Try text generation model first
-            url = f"{self.base_url}/gpt2"
-            payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "max_length": 1000,
-                    "temperature": 0.7,
-                    "do_sample": True,
-                    "num_return_sequences": 1
-                }
+        """Make API request to Hugging Face; raises on failure so it can run off the script thread"""
+        # Try text generation model first
+        url = f"{self.base_url}/gpt2"
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                # One question block is well under this; stop before a second one starts
+                "max_new_tokens": 250,
+                "stop": ["\nQuestion:"],
+                # Only the generated text; the echoed prompt's format template would parse as a question
+                "return_full_text": False,
+                "temperature": 0.7,
+                "do_sample": True,
+                "num_return_sequences": 1
             }
+        }
+        
+        body = json_dumps(payload)
+        for attempt in range(MAX_ATTEMPTS):
+            response = self.client.post(url, content=body)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                break
             
-            response = requests.post(url, headers=self.headers, json=payload)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, list) and len(result) > 0:
-                    return result[0].get('generated_text', '')
-                else:
-                    return result.get('generated_text', '')
+            # Honour Retry-After, otherwise exponential backoff with full jitter
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = min(float(retry_after), BACKOFF_CAP)
             else:
-                st.warning(f"API request failed with status {response.status_code}")
-                return None
-                
-        except Exception as e:
-            st.error(f"API request failed: {str(e)}")
-            return None
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            time.sleep(delay)
+        
+        # Only the final status is reported, not every attempt
+        if response.status_code != 200:
+            raise Exception(f"status {response.status_code}")
+        
+        result = json_loads(response.content)
+        if isinstance(result, list) and len(result) > 0:
+            return result[0].get('generated_text', '')
+        else:
+            return result.get('generated_text', '')
     
-    def _parse_quiz_response(self, response: str, num_questions: int) -> List[Dict[str, Any]]:
+    def _parse_quiz_response(self, response: str) -> List[Dict[str, Any]]:
         """Parse the API response into structured quiz questions"""
-        try:
-            questions = []
-            lines = response.split('\n')
-            current_question = {}
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('Question:'):
-                    if current_question:
-                        questions.append(current_question)
-                    current_question = {
-                        'question': line.replace('Question:', '').strip(),
-                        'options': {},
-                        'correct_answer': '',
-                        'explanation': ''
-                    }
-                elif line.startswith(('A)', 'B)', 'C)', 'D)')):
-                    option_key = line[0]
-                    option_text = line[2:].strip()
-                    if 'options' in current_question:
-                        current_question['options'][option_key] = option_text
-                elif line.startswith('Correct Answer:'):
-                    current_question['correct_answer'] = line.replace('Correct Answer:', '').strip()
-                elif line.startswith('Explanation:'):
-                    current_question['explanation'] = line.replace('Explanation:', '').strip()
-            
-            # Add the last question
-            if current_question and current_question.get('question'):
-                questions.append(current_question)
-            
-            # If parsing failed, return fallback
-            if len(questions) == 0:
-                return self._generate_fallback_quiz(response.split('\n')[0] if response else "General Knowledge", num_questions)
-            
-            return questions[:num_questions]
-            
-        except Exception as e:
-            st.error(f"Failed to parse quiz response: {str(e)}")
-            return self._generate_fallback_quiz("General Knowledge", num_questions)
+        questions = [
+            {
+                'question': match['q'],
+                'options': {'A': match['a'], 'B': match['b'], 'C': match['c'], 'D': match['d']},
+                'correct_answer': match['ca'],
+                'explanation': match['ex']
+            }
+            for match in QUIZ_PATTERN.finditer(response.replace('\r\n', '\n'))
+        ]
+        # Loosely formatted output still goes through the line parser
+        return questions or self._parse_quiz_lines(response)
     
-    def _generate_fallback_quiz(self, topic: str, num_questions: int) -> List[Dict[str, Any]]:
+    def _parse_quiz_lines(self, response: str) -> List[Dict[str, Any]]:
+        """Line-by-line parse that tolerates missing or out-of-order fields"""
+        questions = []
+        lines = response.split('\n')
+        current_question = {}
+        
+        for line in lines:
+            line = line.strip()
+            if line.startswith('Question:'):
+                if current_question:
+                    questions.append(current_question)
+                current_question = {
+                    'question': line[len('Question:'):].strip(),
+                    'options': {},
+                    'correct_answer': '',
+                    'explanation': ''
+                }
+            elif len(line) >= 2 and line[1] == ')' and line[0] in OPTION_KEYS:
+                if 'options' in current_question:
+                    current_question['options'][line[0]] = line[2:].strip()
+            elif line.startswith('Correct Answer:'):
+                current_question['correct_answer'] = line[len('Correct Answer:'):].strip()
+            elif line.startswith('Explanation:'):
+                current_question['explanation'] = line[len('Explanation:'):].strip()
+        
+        # Add the last question
+        if current_question and current_question.get('question'):
+            questions.append(current_question)
+        
+        return questions
+    
+    def generate_fallback_quiz(self, topic: str, num_questions: int) -> List[Dict[str, Any]]:
         """Generate fallback quiz questions when API fails"""
         fallback_questions = [
             {
@@ -192,25 +274,14 @@ Questions:
     
     def evaluate_answer(self, question: Dict[str, Any], user_answer: str) -> Dict[str, Any]:
         """Evaluate user's answer and provide feedback"""
-        try:
-            is_correct = user_answer.upper() == question['correct_answer'].upper()
-            
-            result = {
-                'is_correct': is_correct,
-                'correct_answer': question['correct_answer'],
-                'explanation': question.get('explanation', ''),
-                'user_answer': user_answer,
-                'score': 1 if is_correct else 0
-            }
-            
-            return result
-            
-        except Exception as e:
-            st.error(f"Failed to evaluate answer: {str(e)}")
-            return {
-                'is_correct': False,
-                'correct_answer': question.get('correct_answer', ''),
-                'explanation': question.get('explanation', ''),
-                'user_answer': user_answer,
-                'score': 0
-            }
+        correct_answer = question.get('correct_answer', '')
+        # Compare option letters only, so "b", " B" and "B) ..." all match "B"
+        is_correct = bool(correct_answer) and (user_answer or '').strip()[:1].upper() == correct_answer[:1].upper()
+        
+        return {
+            'is_correct': is_correct,
+            'correct_answer': correct_answer,
+            'explanation': question.get('explanation', ''),
+            'user_answer': user_answer,
+            'score': 1 if is_correct else 0
+        }
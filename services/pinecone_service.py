@@ -1,8 +1,17 @@
 import os
 import json
+import logging
+import copy
+import time
+import threading
+import uuid
+from functools import lru_cache
 import streamlit as st
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
+from collections import deque
+from itertools import islice, takewhile
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 
 try:
@@ -12,14 +21,48 @@ except ImportError:
     PINECONE_AVAILABLE = False
     st.warning("Pinecone library not available. Using local storage fallback.")
 
+try:
+    from pinecone.grpc import PineconeGRPC, GRPCClientConfig
+    PINECONE_GRPC_AVAILABLE = True
+except ImportError:
+    PINECONE_GRPC_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Largest top_k Pinecone allows on a query that includes metadata
+MAX_TOP_K = 1000
+
+# Embedding size of the index; every vector starts as a copy of the zero vector
+EMBEDDING_DIM = 384
+ZERO_VECTOR = [0.0] * EMBEDDING_DIM
+
+# Quizzes kept per user in local storage, newest first
+LOCAL_HISTORY_SIZE = 500
+
+# How long a fetched profile is served from memory before re-fetching
+PROFILE_TTL = 60
+
+@lru_cache(maxsize=4096)
+def _profile_vector_id(user_id: str) -> str:
+    # Existing profile records are stored under this md5-based id, so the hash stays
+    return f"user_{hashlib.md5(user_id.encode()).hexdigest()}"
+
 class PineconeService:
     """Handle Pinecone vector database operations with fallback to local storage"""
     
+    # Feature encodings used by the embeddings
+    ROLE_ENCODING = {'student': 0.1, 'educator': 0.9}
+    LEVEL_ENCODING = {'beginner': 0.2, 'intermediate': 0.5, 'advanced': 0.8}
+    DIFFICULTY_ENCODING = {'easy': 0.2, 'medium': 0.5, 'hard': 0.8}
+    
     def __init__(self):
         self.api_key = os.getenv("PINECONE_API_KEY", "your_pinecone_api_key")
         self.index_name = os.getenv("PINECONE_INDEX_NAME", "edututor")
         self.pc = None
         self.index = None
+        # user_id -> (fetched at, profile); shared by every session using this instance
+        self._profile_cache = {}
+        self._profile_lock = threading.Lock()
         
         if PINECONE_AVAILABLE and self.api_key != "your_pinecone_api_key":
             self._initialize_pinecone()
@@ -30,13 +73,17 @@ class PineconeService:
     def _initialize_pinecone(self):
         """Initialize Pinecone connection"""
         try:
-            self.pc = Pinecone(api_key=self.api_key)
+            # gRPC multiplexes concurrent reads/writes over one HTTP/2 channel
+            if PINECONE_GRPC_AVAILABLE:
+                self.pc = PineconeGRPC(api_key=self.api_key)
+            else:
+                self.pc = Pinecone(api_key=self.api_key)
             
             # Check if index exists, create if not
             if self.index_name not in self.pc.list_indexes().names():
                 self.pc.create_index(
                     name=self.index_name,
-                    dimension=384,  # Using standard embedding dimension
+                    dimension=EMBEDDING_DIM,  # Using standard embedding dimension
                     metric='cosine',
                     spec=ServerlessSpec(
                         cloud='aws',
@@ -44,7 +91,10 @@ class PineconeService:
                     )
                 )
             
-            self.index = self.pc.Index(self.index_name)
+            if PINECONE_GRPC_AVAILABLE:
+                self.index = self.pc.Index(self.index_name, grpc_config=GRPCClientConfig(timeout=5))
+            else:
+                self.index = self.pc.Index(self.index_name)
             st.success("Pinecone initialized successfully!")
             
         except Exception as e:
@@ -52,70 +102,127 @@ class PineconeService:
             self._initialize_local_storage()
     
     def _initialize_local_storage(self):
-        """Initialize local storage fallback"""
+        """Initialize local storage fallback for the current session"""
         if 'user_profiles' not in st.session_state:
             st.session_state.user_profiles = {}
         if 'quiz_history' not in st.session_state:
             st.session_state.quiz_history = {}
+        if 'profiles_by_role' not in st.session_state:
+            # role -> user_ids, so role lookups don't scan every profile
+            st.session_state.profiles_by_role = {}
+    
+    def _store_local_profile(self, user_id: str, profile: Dict[str, Any]):
+        """Write a profile to local storage and keep the role index in step"""
+        self._initialize_local_storage()
+        st.session_state.user_profiles[user_id] = profile
+        role = profile.get('role', 'student')
+        for role_name, user_ids in st.session_state.profiles_by_role.items():
+            if role_name != role:
+                user_ids.discard(user_id)
+        st.session_state.profiles_by_role.setdefault(role, set()).add(user_id)
     
     def create_user_profile(self, user_id: str, user_data: Dict[str, Any]) -> bool:
         """Create or update user profile"""
         try:
-            profile_data = {
-                'user_id': user_id,
-                'name': user_data.get('name', ''),
-                'email': user_data.get('email', ''),
-                'role': user_data.get('role', 'student'),
-                'login_method': user_data.get('login_method', 'manual'),
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat(),
-                'quiz_count': 0,
-                'total_score': 0,
-                'average_score': 0,
-                'preferred_topics': [],
-                'learning_level': 'beginner',
-                'google_info': user_data.get('google_info', {}),
-                'synced_courses': user_data.get('synced_courses', [])
-            }
-            
-            if self.index:
-                # Use Pinecone
-                vector_id = self._generate_vector_id(user_id)
-                embedding = self._create_user_embedding(profile_data)
-                
-                self.index.upsert(vectors=[{
-                    'id': vector_id,
-                    'values': embedding,
-                    'metadata': profile_data
-                }])
-            else:
-                # Use local storage
-                st.session_state.user_profiles[user_id] = profile_data
-            
+            self._upsert_profile(user_id, self._new_user_profile(user_id, user_data))
             return True
             
-        except Exception as e:
-            st.error(f"Failed to create user profile: {str(e)}")
+        except Exception:
+            logger.exception("Failed to create user profile for %s", user_id)
             return False
     
+    def get_or_create_user_profile(self, user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Get user profile, creating it on a miss without fetching it back"""
+        profile = self.get_user_profile(user_id)
+        if profile:
+            return profile
+        
+        try:
+            profile = self._new_user_profile(user_id, user_data)
+            self._upsert_profile(user_id, profile)
+            return profile
+            
+        except Exception:
+            logger.exception("Failed to create user profile for %s", user_id)
+            return None
+    
+    def _new_user_profile(self, user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the initial profile record for a user"""
+        now = datetime.now()
+        return {
+            'user_id': user_id,
+            'name': user_data.get('name', ''),
+            'email': user_data.get('email', ''),
+            'role': user_data.get('role', 'student'),
+            'login_method': user_data.get('login_method', 'manual'),
+            'created_at': now.isoformat(),
+            'updated_at': now.isoformat(),
+            # Numeric copies so dashboards can skip parsing the ISO strings
+            'created_at_ms': int(now.timestamp() * 1000),
+            'updated_at_ms': int(now.timestamp() * 1000),
+            'quiz_count': 0,
+            'total_score': 0,
+            'average_score': 0,
+            'preferred_topics': [],
+            'learning_level': 'beginner',
+            'google_info': user_data.get('google_info', {}),
+            'synced_courses': user_data.get('synced_courses', [])
+        }
+    
+    def _cache_profile(self, user_id: str, profile: Dict[str, Any]):
+        """Remember a profile just read from or written to Pinecone"""
+        with self._profile_lock:
+            self._profile_cache[user_id] = (time.monotonic(), copy.deepcopy(profile))
+    
+    def invalidate_profile(self, user_id: str):
+        """Forget a cached profile so the next read goes to Pinecone"""
+        with self._profile_lock:
+            self._profile_cache.pop(user_id, None)
+    
+    def _upsert_profile(self, user_id: str, profile: Dict[str, Any]):
+        """Write a profile record to Pinecone or local storage"""
+        if self.index:
+            # Use Pinecone
+            vector_id = self._generate_vector_id(user_id)
+            embedding = self._create_user_embedding(profile)
+            
+            self.index.upsert(vectors=[{
+                'id': vector_id,
+                'values': embedding,
+                'metadata': profile
+            }])
+            self._cache_profile(user_id, profile)
+        else:
+            # Use local storage
+            self._store_local_profile(user_id, profile)
+    
     def get_user_profile(self, user_id: str) -> Dict[str, Any]:
         """Get user profile by ID"""
         try:
             if self.index:
+                # Serve recent reads from memory; copies keep callers' edits out of the cache
+                with self._profile_lock:
+                    cached = self._profile_cache.get(user_id)
+                if cached and time.monotonic() - cached[0] < PROFILE_TTL:
+                    return copy.deepcopy(cached[1])
+                
                 # Use Pinecone
                 vector_id = self._generate_vector_id(user_id)
                 result = self.index.fetch(ids=[vector_id])
                 
                 if result.vectors and vector_id in result.vectors:
-                    return result.vectors[vector_id].metadata
+                    profile = result.vectors[vector_id].metadata
+                    self._cache_profile(user_id, profile)
+                    return profile
                 else:
                     return None
             else:
                 # Use local storage
+                self._initialize_local_storage()
                 return st.session_state.user_profiles.get(user_id)
                 
-        except Exception as e:
-            st.error(f"Failed to get user profile: {str(e)}")
+        except Exception:
+            logger.exception("Failed to get user profile for %s", user_id)
             return None
     
     def update_user_profile(self, user_id: str, updates: Dict[str, Any]) -> bool:
@@ -127,31 +234,21 @@ class PineconeService:
             
             # Update profile data
             profile.update(updates)
-            profile['updated_at'] = datetime.now().isoformat()
-            
-            if self.index:
-                # Use Pinecone
-                vector_id = self._generate_vector_id(user_id)
-                embedding = self._create_user_embedding(profile)
-                
-                self.index.upsert(vectors=[{
-                    'id': vector_id,
-                    'values': embedding,
-                    'metadata': profile
-                }])
-            else:
-                # Use local storage
-                st.session_state.user_profiles[user_id] = profile
+            updated_at = datetime.now()
+            profile['updated_at'] = updated_at.isoformat()
+            profile['updated_at_ms'] = int(updated_at.timestamp() * 1000)
             
+            self._upsert_profile(user_id, profile)
             return True
             
-        except Exception as e:
-            st.error(f"Failed to update user profile: {str(e)}")
+        except Exception:
+            logger.exception("Failed to update user profile for %s", user_id)
             return False
     
     def store_quiz_result(self, user_id: str, quiz_data: Dict[str, Any]) -> bool:
         """Store quiz result and update user profile"""
         try:
+            completed_at = datetime.now()
             quiz_result = {
                 'user_id': user_id,
                 'quiz_id': quiz_data.get('quiz_id', self._generate_quiz_id()),
@@ -163,27 +260,12 @@ class PineconeService:
                 'total_questions': quiz_data.get('total_questions', 0),
                 'percentage': quiz_data.get('percentage', 0),
                 'time_taken': quiz_data.get('time_taken', 0),
-                'completed_at': datetime.now().isoformat()
+                'completed_at': completed_at.isoformat(),
+                # Numeric copy of completed_at; Pinecone range filters only work on numbers
+                'completed_at_ms': int(completed_at.timestamp() * 1000)
             }
             
-            # Store quiz result
-            if self.index:
-                # Use Pinecone for quiz storage
-                quiz_vector_id = f"quiz_{user_id}_{quiz_result['quiz_id']}"
-                embedding = self._create_quiz_embedding(quiz_result)
-                
-                self.index.upsert(vectors=[{
-                    'id': quiz_vector_id,
-                    'values': embedding,
-                    'metadata': quiz_result
-                }])
-            else:
-                # Use local storage
-                if user_id not in st.session_state.quiz_history:
-                    st.session_state.quiz_history[user_id] = []
-                st.session_state.quiz_history[user_id].append(quiz_result)
-            
-            # Update user profile with quiz statistics
+            # Fold the quiz into the profile's running statistics
             profile = self.get_user_profile(user_id)
             if profile:
                 profile['quiz_count'] = profile.get('quiz_count', 0) + 1
@@ -197,24 +279,54 @@ class PineconeService:
                     preferred_topics.append(topic)
                 profile['preferred_topics'] = preferred_topics
                 
-                self.update_user_profile(user_id, profile)
+                profile['updated_at'] = completed_at.isoformat()
+                profile['updated_at_ms'] = quiz_result['completed_at_ms']
+            
+            # Store quiz result
+            if self.index:
+                # Use Pinecone - quiz and profile go up in a single round trip
+                vectors = [{
+                    'id': f"quiz_{user_id}_{quiz_result['quiz_id']}",
+                    'values': self._create_quiz_embedding(quiz_result),
+                    'metadata': quiz_result
+                }]
+                if profile:
+                    vectors.append({
+                        'id': self._generate_vector_id(user_id),
+                        'values': self._create_user_embedding(profile),
+                        'metadata': profile
+                    })
+                self.index.upsert(vectors=vectors)
+                if profile:
+                    self._cache_profile(user_id, profile)
+            else:
+                # Use local storage
+                self._initialize_local_storage()
+                history = st.session_state.quiz_history.setdefault(user_id, deque(maxlen=LOCAL_HISTORY_SIZE))
+                history.appendleft(quiz_result)
+                if profile:
+                    self._store_local_profile(user_id, profile)
             
             return True
             
-        except Exception as e:
-            st.error(f"Failed to store quiz result: {str(e)}")
+        except Exception:
+            logger.exception("Failed to store quiz result for %s", user_id)
             return False
     
-    def get_quiz_history(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get quiz history for a user"""
+    def get_quiz_history(self, user_id: str, limit: int = 100, since: datetime = None) -> List[Dict[str, Any]]:
+        """Get up to `limit` quizzes for a user, newest first, optionally only those completed since `since`"""
         try:
             if self.index:
-                # Use Pinecone - query for user's quizzes
-                query_filter = {"user_id": {"$eq": user_id}}
+                # Use Pinecone - query for user's quizzes, skipping the profile record
+                query_filter = {"user_id": {"$eq": user_id}, "quiz_id": {"$exists": True}}
+                if since is not None:
+                    query_filter["completed_at_ms"] = {"$gte": int(since.timestamp() * 1000)}
+                # A zero-vector query returns matches in no particular order, so fetch
+                # them all and take the newest `limit` after sorting
                 results = self.index.query(
-                    vector=[0.0] * 384,  # Dummy vector for metadata-only query
+                    vector=ZERO_VECTOR,  # Dummy vector for metadata-only query
                     filter=query_filter,
-                    top_k=100,
+                    top_k=MAX_TOP_K,
                     include_metadata=True
                 )
                 
@@ -224,93 +336,163 @@ class PineconeService:
                     if metadata.get('quiz_id'):  # This is a quiz record
                         quiz_history.append(metadata)
                 
-                return sorted(quiz_history, key=lambda x: x.get('completed_at', ''), reverse=True)
+                quiz_history.sort(key=lambda x: (x.get('completed_at_ms', 0), x.get('completed_at', '')), reverse=True)
+                return quiz_history[:limit]
             else:
-                # Use local storage
-                return st.session_state.quiz_history.get(user_id, [])
+                # Use local storage - already newest first, so stop at the cutoff
+                self._initialize_local_storage()
+                quiz_history = st.session_state.quiz_history.get(user_id, ())
+                if since is not None:
+                    cutoff = since.isoformat()
+                    quiz_history = takewhile(lambda quiz: quiz.get('completed_at', '') >= cutoff, quiz_history)
+                return list(islice(quiz_history, limit))
                 
-        except Exception as e:
-            st.error(f"Failed to get quiz history: {str(e)}")
+        except Exception:
+            logger.exception("Failed to get quiz history for %s", user_id)
             return []
     
-    def get_all_student_profiles(self) -> List[Dict[str, Any]]:
-        """Get all student profiles for educator dashboard"""
+    def get_quiz_histories_bulk(self, quiz_counts: Dict[str, int]) -> Dict[str, List[Dict[str, Any]]]:
+        """Quiz histories for several users (user_id -> expected quiz count) in as few queries as possible, newest first"""
+        histories = {user_id: [] for user_id in quiz_counts}
         try:
             if self.index:
-                # Use Pinecone - query for student profiles
-                query_filter = {"role": {"$eq": "student"}}
-                results = self.index.query(
-                    vector=[0.0] * 384,  # Dummy vector for metadata-only query
-                    filter=query_filter,
-                    top_k=1000,
-                    include_metadata=True
-                )
+                # Group users so each query's expected matches fit under top_k
+                batches, batch, batch_total = [], [], 0
+                for user_id, count in quiz_counts.items():
+                    if batch and batch_total + count > MAX_TOP_K:
+                        batches.append(batch)
+                        batch, batch_total = [], 0
+                    batch.append(user_id)
+                    batch_total += count
+                if batch:
+                    batches.append(batch)
                 
-                profiles = []
-                for match in results.matches:
-                    metadata = match.metadata
-                    if not metadata.get('quiz_id'):  # This is a user profile, not a quiz
-                        profiles.append(metadata)
+                for batch in batches:
+                    results = self.index.query(
+                        vector=ZERO_VECTOR,  # Dummy vector for metadata-only query
+                        filter={"user_id": {"$in": batch}, "quiz_id": {"$exists": True}},
+                        top_k=MAX_TOP_K,
+                        include_metadata=True
+                    )
+                    for match in results.matches:
+                        histories[match.metadata['user_id']].append(match.metadata)
                 
-                return profiles
+                for quizzes in histories.values():
+                    quizzes.sort(key=lambda x: x.get('completed_at', ''), reverse=True)
+            else:
+                # Use local storage - already newest first
+                self._initialize_local_storage()
+                for user_id in histories:
+                    histories[user_id] = list(st.session_state.quiz_history.get(user_id, ()))
+            
+            return histories
+        
+        except Exception:
+            logger.exception("Failed to get quiz histories")
+            return histories
+    
+    def bulk_load(self, user_id: str, user_data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Load (or create) a user's profile and their quiz history together"""
+        if not self.index:
+            # Local storage lives in session_state, which worker threads cannot see
+            return self.get_or_create_user_profile(user_id, user_data), self.get_quiz_history(user_id)
+        
+        # Issue both Pinecone reads in parallel
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            profile = executor.submit(self.get_or_create_user_profile, user_id, user_data)
+            history = executor.submit(self.get_quiz_history, user_id)
+            return profile.result(), history.result()
+    
+    def get_quiz_aggregates(self, user_id: str, quiz_history: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Summarise quiz history by topic, difficulty and over time"""
+        if quiz_history is None:
+            quiz_history = self.get_quiz_history(user_id)
+        
+        # One pass over the history feeds both groupings and the trend
+        by_topic, by_difficulty, trend = {}, {}, []
+        for quiz in quiz_history:
+            percentage = quiz.get('percentage', 0)
+            for groups, key in ((by_topic, 'topic'), (by_difficulty, 'difficulty')):
+                stats = groups.setdefault(quiz.get(key, ''), {'mean': 0.0, 'count': 0})
+                stats['mean'] += percentage
+                stats['count'] += 1
+            trend.append({'completed_at': quiz.get('completed_at', ''), 'percentage': percentage})
+        
+        for groups in (by_topic, by_difficulty):
+            for stats in groups.values():
+                stats['mean'] /= stats['count']
+        
+        return {
+            'by_topic': by_topic,
+            'by_difficulty': by_difficulty,
+            'trend': sorted(trend, key=lambda x: x['completed_at'])
+        }
+    
+    def get_all_student_profiles(self) -> List[Dict[str, Any]]:
+        """Get all student profiles for educator dashboard"""
+        try:
+            if self.index:
+                # Use Pinecone - profiles are the "user_" ids, so list and fetch
+                # them rather than scoring a dummy vector against the index
+                return [profile for profile in self._fetch_by_prefix("user_")
+                        if profile.get('role') == 'student']
             else:
                 # Use local storage
-                return [profile for profile in st.session_state.user_profiles.values() 
-                       if profile.get('role') == 'student']
+                self._initialize_local_storage()
+                user_profiles = st.session_state.user_profiles
+                return [user_profiles[user_id] for user_id in st.session_state.profiles_by_role.get('student', ())]
                 
-        except Exception as e:
-            st.error(f"Failed to get student profiles: {str(e)}")
+        except Exception:
+            logger.exception("Failed to get student profiles")
             return []
     
+    def _fetch_by_prefix(self, prefix: str) -> List[Dict[str, Any]]:
+        """Metadata of every vector whose id starts with `prefix`, listed by id a page at a time"""
+        records = []
+        for ids in self.index.list(prefix=prefix):
+            result = self.index.fetch(ids=list(ids))
+            records.extend(vector.metadata for vector in result.vectors.values())
+        return records
+    
     def _generate_vector_id(self, user_id: str) -> str:
         """Generate vector ID for user profile"""
-        return f"user_{hashlib.md5(user_id.encode()).hexdigest()}"
+        return _profile_vector_id(user_id)
     
     def _generate_quiz_id(self) -> str:
         """Generate unique quiz ID"""
-        return hashlib.md5(datetime.now().isoformat().encode()).hexdigest()[:12]
+        # Random rather than a hash of the clock, which could collide within a tick
+        return uuid.uuid4().hex[:12]
     
     def _create_user_embedding(self, profile_data: Dict[str, Any]) -> List[float]:
         """Create embedding vector for user profile"""
         # Simple embedding based on profile features
         # In production, you'd use a proper embedding model
-        features = []
+        features = ZERO_VECTOR.copy()
         
         # Role encoding
-        role_encoding = {'student': 0.1, 'educator': 0.9}
-        features.append(role_encoding.get(profile_data.get('role', 'student'), 0.1))
+        features[0] = self.ROLE_ENCODING.get(profile_data.get('role', 'student'), 0.1)
         
         # Learning level encoding
-        level_encoding = {'beginner': 0.2, 'intermediate': 0.5, 'advanced': 0.8}
-        features.append(level_encoding.get(profile_data.get('learning_level', 'beginner'), 0.2))
+        features[1] = self.LEVEL_ENCODING.get(profile_data.get('learning_level', 'beginner'), 0.2)
         
         # Quiz performance
-        features.append(min(profile_data.get('average_score', 0) / 100.0, 1.0))
+        features[2] = min(profile_data.get('average_score', 0) / 100.0, 1.0)
         
-        # Pad to 384 dimensions
-        while len(features) < 384:
-            features.append(0.0)
-        
-        return features[:384]
+        return features
     
     def _create_quiz_embedding(self, quiz_data: Dict[str, Any]) -> List[float]:
         """Create embedding vector for quiz result"""
-        features = []
+        features = ZERO_VECTOR.copy()
         
         # Score encoding
-        features.append(quiz_data.get('percentage', 0) / 100.0)
+        features[0] = quiz_data.get('percentage', 0) / 100.0
         
         # Difficulty encoding
-        difficulty_encoding = {'easy': 0.2, 'medium': 0.5, 'hard': 0.8}
-        features.append(difficulty_encoding.get(quiz_data.get('difficulty', 'medium'), 0.5))
+        features[1] = self.DIFFICULTY_ENCODING.get(quiz_data.get('difficulty', 'medium'), 0.5)
         
         # Topic hash (simple)
         topic = quiz_data.get('topic', '')
-        topic_hash = sum(ord(c) for c in topic) / 1000.0 if topic else 0.0
-        features.append(min(topic_hash, 1.0))
-        
-        # Pad to 384 dimensions
-        while len(features) < 384:
-            features.append(0.0)
+        topic_hash = sum(map(ord, topic)) / 1000.0 if topic else 0.0
+        features[2] = min(topic_hash, 1.0)
         
-        return features[:384]
+        return features
@@ -0,0 +1,31 @@
+from typing import Dict, List, Any
+
+
+def build_question_review(questions: List[Dict[str, Any]], user_answers: Dict[Any, str]) -> List[Dict[str, Any]]:
+    """Work out correctness and option icons for each question once, ready to render"""
+    review = []
+    for i, question in enumerate(questions):
+        # Answers are keyed by int in session state but by str once stored
+        user_answer = user_answers.get(i, user_answers.get(str(i), "Not answered"))
+        correct_answer = question.get('correct_answer', 'Unknown')
+        is_correct = user_answer == correct_answer
+
+        lines = []
+        for key, value in question.get('options', {}).items():
+            icon = ""
+            if key == correct_answer:
+                icon = "✅"
+            elif key == user_answer and not is_correct:
+                icon = "❌"
+            lines.append(f"{icon} {key}) {value}")
+
+        review.append({
+            'question': question['question'],
+            'is_correct': is_correct,
+            'user_answer': user_answer,
+            'correct_answer': correct_answer,
+            'option_lines': lines,
+            'explanation': question.get('explanation', '')
+        })
+
+    return review
@@ -0,0 +1,225 @@
+import streamlit as st
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+from services.pinecone_service import PineconeService
+from services.history_cache import QuizHistoryCache
+
+
+@st.cache_resource
+def get_pinecone_service():
+    """Share one PineconeService (and its index connection) across reruns"""
+    return PineconeService()
+
+
+@st.cache_resource
+def get_hf_service():
+    """Share one HuggingFaceService across reruns and sessions"""
+    from services.huggingface_service import HuggingFaceService
+    return HuggingFaceService()
+
+
+@st.cache_resource
+def get_quiz_parser():
+    """Share one QuizParser across reruns and sessions"""
+    from utils.quiz_parser import QuizParser
+    return QuizParser()
+
+
+@st.cache_resource
+def get_history_cache():
+    """Share one on-disk quiz history cache across sessions"""
+    return QuizHistoryCache()
+
+
+def get_classroom_service():
+    """Build the Google Classroom client lazily, once per session"""
+    # Imported here so googleapiclient's classroom bindings only load on sync
+    from services.classroom_service import ClassroomService
+    
+    # Credentials are per user, so the client is kept in session state
+    classroom_service = st.session_state.get('classroom_service')
+    if classroom_service is None or not classroom_service.service:
+        classroom_service = ClassroomService()
+        st.session_state.classroom_service = classroom_service
+    return classroom_service
+
+
+@st.cache_resource
+def _cache_versions():
+    """Per-user counters passed to the cached loaders, so bumping one drops only that user's entries"""
+    return {}
+
+
+def _cache_version(key):
+    return _cache_versions().get(key, 0)
+
+
+def _bump_cache_version(key):
+    versions = _cache_versions()
+    versions[key] = versions.get(key, 0) + 1
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_classroom_courses(user_id, version):
+    courses = get_classroom_service().get_courses()
+    if courses is None:
+        # Raise so a failed fetch is not cached for the whole TTL
+        raise RuntimeError("Could not fetch courses from Google Classroom. Make sure you are logged in with Google.")
+    return courses, datetime.now().isoformat()
+
+
+def fetch_classroom_courses(user_id, force=False):
+    """Google Classroom courses for a user plus when they were fetched, cached for an hour unless forced"""
+    if force:
+        _bump_cache_version(('classroom', user_id))
+        invalidate_user_caches(user_id)
+    return _fetch_classroom_courses(user_id, _cache_version(('classroom', user_id)))
+
+
+def _days_ago(days):
+    return datetime.now() - timedelta(days=days) if days else None
+
+
+def _synced_quiz_history(user_id, limit, days):
+    # Top up the disk copy with quizzes newer than it has, then read from disk
+    history_cache = get_history_cache()
+    history_cache.sync(user_id, get_pinecone_service())
+    return history_cache.load(user_id, limit=limit, since=_days_ago(days))
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_user_data(user_id, user_info, version):
+    # Profile and delta-synced history in parallel, so a cache miss only pulls new quizzes
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        profile = executor.submit(get_pinecone_service().get_or_create_user_profile, user_id, user_info)
+        history = executor.submit(_synced_quiz_history, user_id, 100, None)
+        return profile.result(), history.result()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_quiz_history(user_id, limit, days, version):
+    return _synced_quiz_history(user_id, limit, days)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_quiz_histories(quiz_counts):
+    return get_pinecone_service().get_quiz_histories_bulk(dict(quiz_counts))
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_student_profiles():
+    return get_pinecone_service().get_all_student_profiles()
+
+
+def load_user_data(user_id, user_info):
+    """Get (or create on first visit) a user's profile plus their quiz history"""
+    pinecone_service = get_pinecone_service()
+    if not pinecone_service.index:
+        # Local storage is per-session and already in memory
+        return pinecone_service.bulk_load(user_id, user_info)
+    return _fetch_user_data(user_id, user_info, _cache_version(user_id))
+
+
+def load_quiz_history(user_id, limit=100, days=None):
+    """Get a user's most recent quizzes (optionally only the last `days`), cached when backed by Pinecone"""
+    pinecone_service = get_pinecone_service()
+    if not pinecone_service.index:
+        return pinecone_service.get_quiz_history(user_id, limit=limit, since=_days_ago(days))
+    # Keyed on days rather than a cutoff timestamp so reruns hit the cache
+    return _fetch_quiz_history(user_id, limit, days, _cache_version(user_id))
+
+
+def load_quiz_histories(quiz_counts):
+    """Get several users' quiz histories at once (user_id -> expected quiz count), cached when backed by Pinecone"""
+    pinecone_service = get_pinecone_service()
+    if not pinecone_service.index:
+        return pinecone_service.get_quiz_histories_bulk(quiz_counts)
+    return _fetch_quiz_histories(tuple(sorted(quiz_counts.items())))
+
+
+def load_student_profiles():
+    """Get every student profile for the educator dashboard, cached briefly when backed by Pinecone"""
+    pinecone_service = get_pinecone_service()
+    if not pinecone_service.index:
+        return pinecone_service.get_all_student_profiles()
+    return _fetch_student_profiles()
+
+
+def load_quiz_aggregates(user_id, quiz_history):
+    """Aggregate an already-loaded quiz history"""
+    # Not cached: one pass over at most a few hundred rows is cheaper than a cache lookup,
+    # and always matches the history it was given
+    return get_pinecone_service().get_quiz_aggregates(user_id, quiz_history)
+
+
+@st.cache_resource
+def get_background_executor():
+    """Shared worker pool for writes that shouldn't hold up a rerun"""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+def _store_quiz_result(user_id, quiz_data):
+    saved = get_pinecone_service().store_quiz_result(user_id, quiz_data)
+    if saved:
+        # Profile stats and history changed; drop this user's cached copies
+        invalidate_user_caches(user_id)
+    return saved
+
+
+def submit_quiz_result(user_id, quiz_data):
+    """Save a quiz result, returning a Future that resolves to whether it was stored"""
+    if not get_pinecone_service().index:
+        # Local storage is session state, which worker threads cannot see
+        future = Future()
+        future.set_result(_store_quiz_result(user_id, quiz_data))
+        return future
+    return get_background_executor().submit(_store_quiz_result, user_id, quiz_data)
+
+
+def invalidate_user_caches(user_id):
+    """Drop one user's cached profile and history, in Streamlit's caches and the service's own"""
+    _bump_cache_version(user_id)
+    get_pinecone_service().invalidate_profile(user_id)
+
+
+@st.fragment(run_every="1s")
+def _poll_quiz_save():
+    """Wait on the background save of the quiz result, retrying once if it fails"""
+    quiz_save = st.session_state.quiz_save
+    future = quiz_save['future']
+    if not future.done():
+        return
+    
+    if future.exception() is None and future.result():
+        quiz_save['saved'] = True
+    elif not quiz_save['retried']:
+        st.toast("Save failed, retrying…")
+        quiz_save['future'] = submit_quiz_result(quiz_save['user_id'], quiz_save['quiz_data'])
+        quiz_save['retried'] = True
+        return
+    else:
+        quiz_save['failed'] = True
+    
+    # Settled: a full rerun reports the outcome and stops this polling
+    st.rerun(scope="app")
+
+
+def track_quiz_save():
+    """Report the outcome of a quiz result saving in the background, on whichever page is open"""
+    quiz_save = st.session_state.get('quiz_save')
+    if quiz_save is None:
+        return
+    if quiz_save['saved']:
+        st.toast("Quiz results saved.")
+        st.session_state.quiz_save = None
+    elif quiz_save['failed']:
+        st.error("Failed to save quiz results.")
+        st.session_state.quiz_save = None
+    else:
+        _poll_quiz_save()
+
+
+def clear_student_caches():
+    """Drop the educator dashboard's cached student profiles and histories"""
+    _fetch_quiz_histories.clear()
+    _fetch_student_profiles.clear()